@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Local authoritative stand-in for the iterative resolver.
+Serves a three-zone hierarchy (root, com., example.com.) over UDP on
+127.0.0.1-127.0.0.3 and resolves example.com through it with
+main.IterativeResolver, both blocking and on asyncio.
+
+Run with --serve to keep the servers up and point the app at them:
+DNS_RESOLUTION_MODE=iterative DNS_ROOT_HINTS=127.0.0.1 DNS_ITERATIVE_PORT=5300
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+# Zone served at each loopback address
+ZONES = {"127.0.0.1": ".", "127.0.0.2": "com.", "127.0.0.3": "example.com."}
+# Delegation below each zone: (child, nameserver, glue address)
+DELEGATIONS = {
+    ".": ("com.", "ns.com.", "127.0.0.2"),
+    "com.": ("example.com.", "ns.example.com.", "127.0.0.3"),
+}
+KEY = (
+    "AwEAAagAIKlVZrpC6Ia7gEzahOR+9W29euxhJhVVLOyQbSEW0O8gcCjFFVQUTf6v58fLjwBd0YI0EzrA"
+    "cQqBGCzh/RStIoO8g0NfnfL2MTJRkxoXbfDaUeVPQuYEhg37NZWAJQ9VnMVDxP/VHL496M/QZxkjf5/E"
+    "fucp2gaDX6RS6CXpoY68LsvPVjR0ZSwzz1apAzvN9dlzEheX7ICJBBtuA6G3LQpzW5hOA2hzCTMjJPJ8"
+    "LbqF6dsV6DoBQzgul0sGIcGOYl7OyQdXfZ57relSQageu+ipAdTTJ25AsRTAoub8ONGcLmqrAmRLKBP1"
+    "dfwhYB4N7knNnulqQxA+Uk1ihz0="
+)
+DS = "12345 8 2 49AAC11D7B6F6446702E54A1607371607A1A41855200FD2CE1CDDE32F24E8FB5"
+# Record data every zone serves at its apex
+APEX = {
+    "DNSKEY": [f"257 3 8 {KEY}", f"256 3 8 {KEY}"],
+    "SOA": ["ns.example.net. hostmaster.example.net. 1 7200 3600 1209600 3600"],
+    "A": ["192.0.2.1"],
+    "TXT": ['"stand-in"'],
+}
+
+# (server address, query name, query type) of every query received
+queries: List[Tuple[str, str, str]] = []
+queries_lock = threading.Lock()
+
+
+def signature(name: str, rdtype: str, zone: str) -> dns.rrset.RRset:
+    return dns.rrset.from_text(
+        name, 300, "IN", "RRSIG", f"{rdtype} 8 1 300 20300101000000 20200101000000 12345 {zone} AAAA"
+    )
+
+
+def answer(zone: str, query: dns.message.Message) -> dns.message.Message:
+    """Build the authoritative answer or referral for a query to zone."""
+    qname = query.question[0].name
+    rdtype = dns.rdatatype.to_text(query.question[0].rdtype)
+    response = dns.message.make_response(query)
+    delegation = DELEGATIONS.get(zone)
+    if delegation:
+        child, ns, glue = delegation
+        child_name = dns.name.from_text(child)
+        # DS for the child is answered by the parent; anything else below is referred
+        if qname == child_name and rdtype == "DS":
+            response.flags |= dns.flags.AA
+            response.answer.append(dns.rrset.from_text(child, 300, "IN", "DS", DS))
+            response.answer.append(signature(child, "DS", zone))
+            return response
+        if qname.is_subdomain(child_name):
+            response.authority.append(dns.rrset.from_text(child, 600, "IN", "NS", ns))
+            response.authority.append(dns.rrset.from_text(child, 600, "IN", "DS", DS))
+            response.authority.append(signature(child, "DS", zone))
+            response.additional.append(dns.rrset.from_text(ns, 600, "IN", "A", glue))
+            return response
+    response.flags |= dns.flags.AA
+    if qname != dns.name.from_text(zone):
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        response.authority.append(dns.rrset.from_text(zone, 300, "IN", "SOA", APEX["SOA"][0]))
+        return response
+    if rdtype == "NS":
+        response.answer.append(dns.rrset.from_text(zone, 600, "IN", "NS", f"ns.{zone}" if zone != "." else "a.root."))
+    elif rdtype in APEX:
+        response.answer.append(dns.rrset.from_text(zone, 300, "IN", rdtype, *APEX[rdtype]))
+        response.answer.append(signature(zone, rdtype, zone))
+    else:
+        response.authority.append(dns.rrset.from_text(zone, 300, "IN", "SOA", APEX["SOA"][0]))
+    return response
+
+
+def serve(address: str, port: int) -> None:
+    """Answer queries for the zone of address on a background thread."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((address, port))
+    zone = ZONES[address]
+
+    def loop() -> None:
+        while True:
+            data, client = sock.recvfrom(4096)
+            try:
+                query = dns.message.from_wire(data)
+                with queries_lock:
+                    queries.append((address, query.question[0].name.to_text(),
+                                    dns.rdatatype.to_text(query.question[0].rdtype)))
+                sock.sendto(answer(zone, query).to_wire(), client)
+            except Exception as e:
+                print(f"Error answering query on {address}: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
+
+
+def start(port: int) -> None:
+    for address in ZONES:
+        serve(address, port)
+
+
+def check(port: int) -> bool:
+    """Resolve through the stand-in servers and report whether each lookup
+    got the expected answer from the expected servers."""
+    import main
+
+    ok = True
+
+    def expect(label: str, response: Optional[dns.message.Message], rdtype: str, count: int) -> None:
+        nonlocal ok
+        found = [rrset for rrset in (response.answer if response else [])
+                 if dns.rdatatype.to_text(rrset.rdtype) == rdtype]
+        passed = bool(found) and len(found[0]) == count
+        ok = ok and passed
+        print(f"{'ok  ' if passed else 'FAIL'} {label}: {len(found[0]) if found else 0} {rdtype} record(s)")
+
+    resolver = main.IterativeResolver([f"127.0.0.1#{port}"], port, timeout=2)
+    expect("DNSKEY example.com", resolver.resolve("example.com", "DNSKEY"), "DNSKEY", 2)
+    expect("A example.com", resolver.resolve("example.com", "A"), "A", 1)
+    before = len(queries)
+    expect("DS example.com (from referral)", resolver.resolve("example.com", "DS"), "DS", 1)
+    if len(queries) != before:
+        ok = False
+        print("FAIL DS example.com needed a query despite the signed referral")
+
+    resolver = main.IterativeResolver([f"127.0.0.1#{port}"], port, timeout=2)
+    expect("async DNSKEY com", asyncio.run(resolver.resolve_async("com", "DNSKEY")), "DNSKEY", 2)
+    expect("async TXT example.com", asyncio.run(resolver.resolve_async("example.com", "TXT")), "TXT", 1)
+
+    per_server: Dict[str, int] = {}
+    for address, _, _ in queries:
+        per_server[address] = per_server.get(address, 0) + 1
+    print(f"queries per server: {per_server}")
+    return ok
+
+
+def run() -> int:
+    parser = argparse.ArgumentParser(description="Local authoritative stand-in for iterative resolution")
+    parser.add_argument("--port", type=int, default=5300, help="UDP port every stand-in server listens on")
+    parser.add_argument("--serve", action="store_true", help="keep serving instead of running the checks")
+    args = parser.parse_args()
+    start(args.port)
+    if args.serve:
+        print(f"Serving {', '.join(f'{zone} on {address}' for address, zone in ZONES.items())}, port {args.port}")
+        while True:
+            time.sleep(3600)
+    return 0 if check(args.port) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,7 +1,9 @@
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
@@ -9,15 +11,23 @@ import os
 import dns.resolver
 import dns.name
 import dns.rdatatype
+import dns.rcode
+import dns.flags
+import dns.exception
+import dns.rrset
 import dns.dnssec
 import dns.message
 import dns.query
+import dns.asyncquery
+import dns.asyncbackend
 import socket
+import ssl
 import sys
 import argparse
 import json
+import sqlite3
 import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Callable
 import binascii
 import hashlib
 import base64
@@ -26,13 +36,34 @@ import logging
 import smtplib
 from email.message import EmailMessage
 import uuid
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from abc import ABC, abstractmethod
 
 # Helper to consistently normalize domain names for caching
 def normalize_domain(domain: str) -> str:
     """Normalize domain names used as cache keys."""
     return domain.lower().rstrip('.')
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the shared analyzer, load the stats and start the stats
+    retention timer before serving requests; stop them on shutdown."""
+    await run_in_threadpool(analyzer_service.start)
+    await run_in_threadpool(load_stats)
+    stats_store.schedule_retention()
+    try:
+        yield
+    finally:
+        stats_store.cancel_retention()
+        await run_in_threadpool(analyzer_service.stop)
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -42,15 +73,105 @@ app.add_middleware(
 )
 
 DATA_FILE_PATH = os.path.join(os.path.dirname(__file__), "data.txt")
+# SQLite database shared by all worker processes: users, posts, stats and the
+# chain cache. The older data.txt and JSON files are imported into it once.
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", os.path.join(os.path.dirname(__file__), "state.db"))
 # Store logs outside the project directory to avoid triggering frontend hot reloads
 LOG_FILE_PATH = os.path.join("C:\\Users\\ahmad\\Desktop\\logs.txt")
-# Cache data is stored in a simple text file in the project directory
+# Files the chain cache, stats and posts were kept in before the state
+# database; each is imported once if present
 CACHE_FILE_PATH = os.path.join(os.path.dirname(__file__), "chain_cache.txt")
 STATS_FILE_PATH = os.path.join(os.path.dirname(__file__), "stats.json")
 STATS_HISTORY_FILE_PATH = os.path.join(os.path.dirname(__file__), "stats_history.json")
 BLOG_POSTS_FILE = os.path.join(os.path.dirname(__file__), "blog_posts.json")
 BLOG_IMAGES_DIR = os.path.join(os.path.dirname(__file__), "public", "blog_images")
 os.makedirs(BLOG_IMAGES_DIR, exist_ok=True)
+# Upper bound on DNS queries in flight while building a single chain
+CHAIN_FETCH_WORKERS = int(os.environ.get("CHAIN_FETCH_WORKERS", "16"))
+# Seconds allowed for fetching every record of a chain before giving up
+CHAIN_FETCH_DEADLINE = float(os.environ.get("CHAIN_FETCH_DEADLINE", "20"))
+# Maximum lookups one chain analysis may send to the network
+CHAIN_QUERY_BUDGET = int(os.environ.get("CHAIN_QUERY_BUDGET", "200"))
+# Cache lifetime in seconds for an analysis that ran out of budget
+CHAIN_INCOMPLETE_TTL = int(os.environ.get("CHAIN_INCOMPLETE_TTL", "60"))
+# Recursive resolvers used for chain data, comma-separated; "ip#port" picks a port
+DNS_UPSTREAMS = [
+    server.strip() for server in os.environ.get("DNS_UPSTREAMS", "8.8.8.8,1.1.1.1,9.9.9.9").split(",")
+    if server.strip()
+]
+# Longest time to wait for one upstream to answer a query
+DNS_QUERY_TIMEOUT = float(os.environ.get("DNS_QUERY_TIMEOUT", "10"))
+# Shortest per-attempt timeout once an upstream's round trip time is known
+DNS_QUERY_MIN_TIMEOUT = float(os.environ.get("DNS_QUERY_MIN_TIMEOUT", "0.5"))
+# Seconds a failing upstream is moved behind the healthy ones
+DNS_UPSTREAM_PENALTY = float(os.environ.get("DNS_UPSTREAM_PENALTY", "30"))
+# Transport for queries retried after a truncated UDP answer: "tcp", or "tls"
+# for DNS over TLS to the upstream resolvers
+DNS_STREAM_TRANSPORT = os.environ.get("DNS_STREAM_TRANSPORT", "tcp")
+# Port used for DNS over TLS upstream connections
+DNS_TLS_PORT = int(os.environ.get("DNS_TLS_PORT", "853"))
+# Idle connections kept open per server for truncated-answer retries
+DNS_STREAM_MAX_IDLE = int(os.environ.get("DNS_STREAM_MAX_IDLE", "4"))
+# Seconds an idle TCP/TLS connection is kept before it is closed
+DNS_STREAM_IDLE_TIMEOUT = float(os.environ.get("DNS_STREAM_IDLE_TIMEOUT", "20"))
+# "recursive" asks DNS_UPSTREAMS; "iterative" walks the delegation from the root
+DNS_RESOLUTION_MODE = os.environ.get("DNS_RESOLUTION_MODE", "recursive")
+# Root server addresses used by iterative mode, comma-separated ("ip" or "ip#port")
+DNS_ROOT_HINTS = [
+    server.strip() for server in os.environ.get(
+        "DNS_ROOT_HINTS",
+        "198.41.0.4,199.9.14.201,192.33.4.12,199.7.91.13,192.203.230.10,192.5.5.241,"
+        "192.112.36.4,198.97.190.53,192.36.148.17,192.58.128.30,193.0.14.129,"
+        "199.7.83.42,202.12.27.33",
+    ).split(",")
+    if server.strip()
+]
+# Port used for nameservers learnt from referrals in iterative mode
+DNS_ITERATIVE_PORT = int(os.environ.get("DNS_ITERATIVE_PORT", "53"))
+# Send a query to the next upstream when the current one is slower than usual
+DNS_HEDGE_ENABLED = os.environ.get("DNS_HEDGE_ENABLED", "0") == "1"
+# Latency percentile of an upstream after which a hedged query is sent
+DNS_HEDGE_PERCENTILE = float(os.environ.get("DNS_HEDGE_PERCENTILE", "95"))
+# Number of recent round trip times kept per upstream for the percentile
+DNS_HEDGE_SAMPLES = int(os.environ.get("DNS_HEDGE_SAMPLES", "200"))
+# Domains analysed at the same time by POST /chain/batch
+CHAIN_BATCH_CONCURRENCY = int(os.environ.get("CHAIN_BATCH_CONCURRENCY", "32"))
+# Largest number of domains accepted in one batch request
+CHAIN_BATCH_MAX_DOMAINS = int(os.environ.get("CHAIN_BATCH_MAX_DOMAINS", "5000"))
+# Number of analysed chains kept in each worker's memory in front of the
+# shared state database
+CHAIN_CACHE_MAX_ENTRIES = int(os.environ.get("CHAIN_CACHE_MAX_ENTRIES", "1024"))
+# Days raw stats event timestamps are kept; older events survive only in the
+# rollups. Minute and hour rollups are kept for their own periods and daily
+# rollups forever.
+STATS_RAW_RETENTION_DAYS = float(os.environ.get("STATS_RAW_RETENTION_DAYS", "30"))
+STATS_MINUTE_RETENTION_DAYS = float(os.environ.get("STATS_MINUTE_RETENTION_DAYS", "2"))
+STATS_HOUR_RETENTION_DAYS = float(os.environ.get("STATS_HOUR_RETENTION_DAYS", "90"))
+# Rollup bucket sizes and the ISO timestamp prefix that identifies a bucket
+STATS_BUCKETS = {"minute": 16, "hour": 13, "day": 10}
+# Domains tracked by each top-K sketch behind /stats/top
+STATS_TOP_CAPACITY = int(os.environ.get("STATS_TOP_CAPACITY", "1000"))
+# /stats/top windows: (span in seconds, number of sub-sketches it is split
+# into); "all" covers every event ever recorded
+STATS_TOP_WINDOWS = {"hour": (3600, 12), "day": (86400, 24), "week": (7 * 86400, 7)}
+# Seconds an expired chain may still be served (flagged stale) while it is
+# refreshed in the background; 0 disables stale-while-revalidate
+CHAIN_CACHE_STALE_GRACE = float(os.environ.get("CHAIN_CACHE_STALE_GRACE", "3600"))
+# Longest time an analysed chain is cached; shorter record TTLs win
+CHAIN_CACHE_MAX_TTL = int(os.environ.get("CHAIN_CACHE_MAX_TTL", "3600"))
+# Number of DNS responses kept in the per-RRset cache
+RRSET_CACHE_MAX_ENTRIES = int(os.environ.get("RRSET_CACHE_MAX_ENTRIES", "10000"))
+# Upper bound on how long a cached response is trusted (0 disables the cap)
+RRSET_CACHE_MAX_TTL = int(os.environ.get("RRSET_CACHE_MAX_TTL", "3600"))
+# Lifetime of cached responses that carry no TTL to go by
+RRSET_CACHE_NEGATIVE_TTL = int(os.environ.get("RRSET_CACHE_NEGATIVE_TTL", "60"))
+# Fraction of a root/TLD snapshot's lifetime after which it is refreshed
+LEVEL_SNAPSHOT_REFRESH_AT = float(os.environ.get("LEVEL_SNAPSHOT_REFRESH_AT", "0.8"))
+# Root and TLD levels fetched into the snapshot store when the server starts
+LEVEL_SNAPSHOT_WARM_ZONES = [
+    zone.strip() for zone in os.environ.get("LEVEL_SNAPSHOT_WARM_ZONES", ".,com,net,org").split(",")
+    if zone.strip()
+]
 app.mount("/blog_images", StaticFiles(directory=BLOG_IMAGES_DIR), name="blog-images")
 
 # Configure application logging
@@ -60,7 +181,8 @@ handler = logging.FileHandler(LOG_FILE_PATH)
 handler.setFormatter(logging.Formatter('%(asctime)s,%(message)s'))
 logger.addHandler(handler)
 
-# Basic file-based cache for storing DNS chain data.
+# Readers for the files state was kept in before the state database; each
+# is imported once by the store that replaced it.
 def _read_file_cache() -> Dict[str, Any]:
     """Load cache dictionary from disk."""
     try:
@@ -72,15 +194,6 @@ def _read_file_cache() -> Dict[str, Any]:
     return {}
 
 
-def _write_file_cache(cache: Dict[str, Any]) -> None:
-    """Persist cache dictionary to disk."""
-    try:
-        with open(CACHE_FILE_PATH, "w") as f:
-            json.dump(cache, f)
-    except Exception:
-        pass
-
-
 def _read_stats() -> Dict[str, Any]:
     """Load global graph generation statistics from disk."""
     try:
@@ -92,16 +205,7 @@ def _read_stats() -> Dict[str, Any]:
     return {"total": 0, "domains": {}}
 
 
-def _write_stats(stats: Dict[str, Any]) -> None:
-    """Persist global graph generation statistics to disk."""
-    try:
-        with open(STATS_FILE_PATH, "w") as f:
-            json.dump(stats, f)
-    except Exception:
-        pass
-
-
-def _read_stats_history() -> Dict[str, List[str]]:
+def _read_stats_history() -> Dict[str, Any]:
     """Load per-domain statistics history from disk."""
     try:
         if os.path.exists(STATS_HISTORY_FILE_PATH):
@@ -112,15 +216,6 @@ def _read_stats_history() -> Dict[str, List[str]]:
     return {}
 
 
-def _write_stats_history(history: Dict[str, List[str]]) -> None:
-    """Persist per-domain statistics history to disk."""
-    try:
-        with open(STATS_HISTORY_FILE_PATH, "w") as f:
-            json.dump(history, f)
-    except Exception:
-        pass
-
-
 def _read_blog_posts() -> List[Dict[str, Any]]:
     """Load blog posts from disk."""
     try:
@@ -132,16 +227,240 @@ def _read_blog_posts() -> List[Dict[str, Any]]:
     return []
 
 
-def _write_blog_posts(posts: List[Dict[str, Any]]) -> None:
-    """Persist blog posts to disk."""
-    try:
-        with open(BLOG_POSTS_FILE, "w") as f:
-            json.dump(posts, f)
-    except Exception:
-        pass
+class StateBackend(ABC):
+    """Storage for the state every worker process must agree on.
 
-data = []
-next_user_id = 1
+    Values are JSON documents stored under (namespace, key). Logs are
+    append-only streams of (key, value) entries with increasing ids.
+    Bucketed counters hold an integer per (key, label), where labels are
+    sortable, e.g. time bucket starts, and can be dropped by label range.
+    Calls made inside transaction() are applied atomically and are
+    serialized against other workers' transactions; reads made inside
+    snapshot() see one consistent state without holding up writers.
+    """
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager for an atomic read-write transaction"""
+
+    @abstractmethod
+    def snapshot(self):
+        """Context manager for a consistent read-only view"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """The value stored under key, or default"""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        """Store value under key, replacing any previous value"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        """Remove key if present"""
+
+    @abstractmethod
+    def items(self, namespace: str, prefix: str = "") -> List[Tuple[str, Any]]:
+        """(key, value) pairs of namespace whose key starts with prefix, by key"""
+
+    @abstractmethod
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Add amount to an integer value (0 if missing) and return the result"""
+
+    @abstractmethod
+    def append(self, log: str, key: str, value: str) -> int:
+        """Append an entry to log and return its id"""
+
+    @abstractmethod
+    def read_log(self, log: str, key: Optional[str] = None, start: Optional[str] = None,
+                 end: Optional[str] = None, after: int = 0) -> List[Tuple[int, str, str]]:
+        """(id, key, value) entries of log in id order, limited to key, to
+        start <= value < end and to ids above after"""
+
+    @abstractmethod
+    def last_id(self, log: str) -> int:
+        """Id of the newest entry of log, or 0"""
+
+    @abstractmethod
+    def trim_log(self, log: str, before: str) -> None:
+        """Delete the entries of log whose value sorts before before"""
+
+    @abstractmethod
+    def incr_bucket(self, counter: str, key: str, label: str, amount: int = 1) -> None:
+        """Add amount to the (key, label) count of counter"""
+
+    @abstractmethod
+    def buckets(self, counter: str, key: str) -> List[Tuple[str, int]]:
+        """(label, count) pairs of key in counter, by label"""
+
+    @abstractmethod
+    def trim_buckets(self, counter: str, before: str) -> None:
+        """Delete the counts of counter, for every key, whose label sorts before before"""
+
+    def import_once(self, marker: str, load: Callable[[], None]) -> None:
+        """Run load in a transaction unless a worker already did for marker.
+        Once done this only reads, so it never waits for the write lock."""
+        if self.get("meta", marker) is not None:
+            return
+        with self.transaction():
+            if self.get("meta", marker) is None:
+                load()
+                self.put("meta", marker, datetime.datetime.utcnow().isoformat())
+
+
+class SQLiteStateBackend(StateBackend):
+    """StateBackend in a local SQLite database.
+
+    Each thread uses its own connection. The database runs in WAL mode, so
+    readers in any worker never wait for a writer. Transactions take the
+    write lock up front (BEGIN IMMEDIATE); snapshots are deferred
+    transactions, which only read. Both may be nested; only the outermost
+    one commits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS log (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "stream TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS log_id ON log (stream, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS log_key ON log (stream, key, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS log_value ON log (stream, value)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters (counter TEXT NOT NULL, key TEXT NOT NULL, "
+                "label TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (counter, key, label))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS counters_label ON counters (counter, label)")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def transaction(self):
+        return self._begin("BEGIN IMMEDIATE")
+
+    def snapshot(self):
+        return self._begin("BEGIN DEFERRED")
+
+    @contextmanager
+    def _begin(self, statement: str):
+        conn = self._connect()
+        outermost = self._local.depth == 0
+        if outermost:
+            conn.execute(statement)
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if outermost:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if outermost:
+            conn.execute("COMMIT")
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        self._connect().execute(
+            "INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+            (namespace, key, json.dumps(value)),
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._connect().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str, prefix: str = "") -> List[Tuple[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT key, value FROM kv WHERE namespace = ? AND key >= ? AND key < ? ORDER BY key",
+            (namespace, prefix, prefix + "\U0010ffff"),
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        row = self._connect().execute(
+            "INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value "
+            "RETURNING value",
+            (namespace, key, amount),
+        ).fetchone()
+        return int(row[0])
+
+    def append(self, log: str, key: str, value: str) -> int:
+        cursor = self._connect().execute("INSERT INTO log (stream, key, value) VALUES (?, ?, ?)", (log, key, value))
+        return cursor.lastrowid
+
+    def read_log(self, log: str, key: Optional[str] = None, start: Optional[str] = None,
+                 end: Optional[str] = None, after: int = 0) -> List[Tuple[int, str, str]]:
+        sql = "SELECT id, key, value FROM log WHERE stream = ?"
+        args: List[Any] = [log]
+        if after:
+            sql += " AND id > ?"
+            args.append(after)
+        if key is not None:
+            sql += " AND key = ?"
+            args.append(key)
+        if start is not None:
+            sql += " AND value >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND value < ?"
+            args.append(end)
+        return self._connect().execute(sql + " ORDER BY id", args).fetchall()
+
+    def last_id(self, log: str) -> int:
+        row = self._connect().execute("SELECT MAX(id) FROM log WHERE stream = ?", (log,)).fetchone()
+        return row[0] or 0
+
+    def _delete_in_batches(self, table: str, where: str, args: Tuple) -> None:
+        """Delete matching rows a batch at a time; outside a transaction each
+        batch commits on its own, so other writers are only briefly held up."""
+        conn = self._connect()
+        while True:
+            cursor = conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT 1000)", args
+            )
+            if cursor.rowcount < 1000:
+                break
+
+    def trim_log(self, log: str, before: str) -> None:
+        self._delete_in_batches("log", "stream = ? AND value < ?", (log, before))
+
+    def incr_bucket(self, counter: str, key: str, label: str, amount: int = 1) -> None:
+        self._connect().execute(
+            "INSERT INTO counters (counter, key, label, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (counter, key, label) DO UPDATE SET count = count + excluded.count",
+            (counter, key, label, amount),
+        )
+
+    def buckets(self, counter: str, key: str) -> List[Tuple[str, int]]:
+        return self._connect().execute(
+            "SELECT label, count FROM counters WHERE counter = ? AND key = ? ORDER BY label", (counter, key)
+        ).fetchall()
+
+    def trim_buckets(self, counter: str, before: str) -> None:
+        self._delete_in_batches("counters", "counter = ? AND label < ?", (counter, before))
+
+
+state_backend = SQLiteStateBackend(STATE_DB_PATH)
 
 # Fallback root DNSKEY information used when live DNS queries fail. This provides
 # one KSK and three ZSKs so the frontend can always render the root zone.
@@ -233,45 +552,1426 @@ def append_log(event: str, user_id: Optional[str] = "", domain: str = "", date:
         pass
 
 
-def get_cached_chain(domain: str) -> Optional[Dict[str, Any]]:
-    """Retrieve cached chain data from the cache file."""
-    key = normalize_domain(domain)
-    cache = _read_file_cache()
-    entry = cache.get(key)
-    if entry and time.time() < entry.get("expires", 0):
-        return entry.get("data")
-    if entry:
-        cache.pop(key, None)
-        _write_file_cache(cache)
-    return None
+class LRUCache:
+    """Thread-safe mapping bounded to max_entries with least-recently-used eviction."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        """Return the value for key and mark it as recently used."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        """Insert or replace key, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
+    def pop(self, key: Any) -> Any:
+        """Remove key and return its value if present."""
+        with self._lock:
+            return self._entries.pop(key, None)
 
-def set_cached_chain(domain: str, chain: Dict[str, Any], ttl: int = 3600) -> None:
-    """Store chain data in the cache file."""
-    key = normalize_domain(domain)
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Return a snapshot of the entries from least to most recently used."""
+        with self._lock:
+            return list(self._entries.items())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ChainCache:
+    """Analysed chains shared by all workers through the state backend.
+
+    Each worker keeps an LRU of recently used entries in front of the
+    backend, so repeated lookups do not touch the database. Expired entries
+    are kept for stale_grace seconds so they can be served while a fresh
+    analysis runs. chain_cache.txt, if present, is imported once.
+    """
+
+    def __init__(self, backend: StateBackend, max_entries: int, stale_grace: float = 0):
+        self.backend = backend
+        self.stale_grace = stale_grace
+        self.stale_served = 0
+        self._entries = LRUCache(max_entries)
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def load(self) -> None:
+        """Import chain_cache.txt into the backend if no worker has yet."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.backend.import_once("chain_cache_imported", self._import_file)
+            self._loaded = True
+
+    def _import_file(self) -> None:
+        now = time.time()
+        for key, entry in _read_file_cache().items():
+            if now < entry.get("expires", 0) + self.stale_grace:
+                self.backend.put("chain", key, entry)
+
+    def lookup(self, key: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Return (entry, stale). Entries past their expiry but within the
+        stale grace window are returned with stale=True."""
+        self.load()
+        now = time.time()
+        entry = self._entries.get(key)
+        if not entry or now >= entry.get("expires", 0):
+            # Another worker may have stored a fresher analysis
+            entry = self.backend.get("chain", key)
+            if not entry:
+                self._entries.pop(key)
+                return None, False
+            self._entries.set(key, entry)
+        expires = entry.get("expires", 0)
+        if now < expires:
+            return entry, False
+        if now < expires + self.stale_grace:
+            return entry, True
+        self._entries.pop(key)
+        self.backend.delete("chain", key)
+        return None, False
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for key unless it has expired."""
+        entry, stale = self.lookup(key)
+        return None if stale else entry
+
+    def set(self, key: str, entry: Dict[str, Any]) -> None:
+        """Store an entry for every worker."""
+        self.load()
+        self._entries.set(key, entry)
+        self.backend.put("chain", key, entry)
+
+    def flush(self) -> None:
+        """Delete entries past their stale grace window from the backend."""
+        if not self._loaded:
+            return
+        now = time.time()
+        with self.backend.transaction():
+            for key, entry in self.backend.items("chain"):
+                if now >= entry.get("expires", 0) + self.stale_grace:
+                    self.backend.delete("chain", key)
+
+
+chain_cache = ChainCache(state_backend, CHAIN_CACHE_MAX_ENTRIES, CHAIN_CACHE_STALE_GRACE)
+
+
+class StatsStore:
+    """Graph generation counters and per-domain history in the state backend.
+
+    record() increments the counters and the per-domain minute, hour and day
+    rollups and appends the event to the "stats_events" log, all in one
+    transaction, so every worker sees the same counts. Raw events and fine
+    rollups older than their retention period are dropped by a background
+    timer, at most once an hour across all workers, leaving the coarser
+    rollups to cover them. stats.json and stats_history.json, if present,
+    are imported once.
+    """
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._retention_timer: Optional[threading.Timer] = None
+
+    def load(self) -> None:
+        """Import the stats files into the backend if no worker has yet."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.backend.import_once("stats_files_imported", self._import_files)
+            self._loaded = True
+
+    def _import_files(self) -> None:
+        """Copy the counters of stats.json and the events of
+        stats_history.json into the backend, building the rollups."""
+        stats = _read_stats()
+        history = _read_stats_history()
+        self.backend.incr("stats", "total", stats.get("total", 0))
+        for domain, count in stats.get("domains", {}).items():
+            self.backend.incr("stats_domains", domain, count)
+        events = sorted((timestamp, domain) for domain, times in history.items() for timestamp in times)
+        # rollups[bucket][(domain, timestamp prefix)] = count
+        rollups: Dict[str, Dict[Tuple[str, str], int]] = {bucket: {} for bucket in STATS_BUCKETS}
+        for timestamp, domain in events:
+            self.backend.append("stats_events", domain, timestamp)
+            for bucket, width in STATS_BUCKETS.items():
+                key = (domain, timestamp[:width])
+                rollups[bucket][key] = rollups[bucket].get(key, 0) + 1
+        for bucket, counts in rollups.items():
+            for (domain, label), count in counts.items():
+                self.backend.incr_bucket(f"stats_{bucket}", domain, label, count)
+
+    def record(self, domain: str) -> None:
+        """Count one graph generation for domain."""
+        self.load()
+        with self.backend.transaction():
+            # Taken inside the transaction so the event log stays in time order
+            timestamp = datetime.datetime.utcnow().isoformat()
+            self.backend.incr("stats", "total")
+            self.backend.incr("stats_domains", domain)
+            for bucket, width in STATS_BUCKETS.items():
+                self.backend.incr_bucket(f"stats_{bucket}", domain, timestamp[:width])
+            self.backend.append("stats_events", domain, timestamp)
+
+    def schedule_retention(self, delay: float = 0) -> None:
+        """Run apply_retention after delay seconds and then every hour."""
+        def run() -> None:
+            try:
+                self.apply_retention()
+            except Exception as e:
+                print(f"Error applying stats retention: {e}")
+            self.schedule_retention(3600)
+
+        self._retention_timer = threading.Timer(delay, run)
+        self._retention_timer.daemon = True
+        self._retention_timer.start()
+
+    def cancel_retention(self) -> None:
+        if self._retention_timer is not None:
+            self._retention_timer.cancel()
+            self._retention_timer = None
+
+    def apply_retention(self) -> None:
+        """Drop raw events and rollup buckets past their retention, unless
+        some worker already did so within the last hour."""
+        now = datetime.datetime.utcnow()
+        with self.backend.transaction():
+            last = self.backend.get("meta", "stats_retention_at")
+            if last and now - datetime.datetime.fromisoformat(last) < datetime.timedelta(hours=1):
+                return
+            self.backend.put("meta", "stats_retention_at", now.isoformat())
+        # Outside a transaction, so the deletes commit in small batches
+        cutoff = (now - datetime.timedelta(days=STATS_RAW_RETENTION_DAYS)).isoformat()
+        self.backend.trim_log("stats_events", cutoff)
+        for bucket, days in (("minute", STATS_MINUTE_RETENTION_DAYS), ("hour", STATS_HOUR_RETENTION_DAYS)):
+            cutoff = (now - datetime.timedelta(days=days)).isoformat()[:STATS_BUCKETS[bucket]]
+            self.backend.trim_buckets(f"stats_{bucket}", cutoff)
+
+    def totals(self) -> Dict[str, Any]:
+        """The {"total", "domains"} counters."""
+        self.load()
+        with self.backend.snapshot():
+            return {
+                "total": self.backend.get("stats", "total", 0),
+                "domains": dict(self.backend.items("stats_domains")),
+            }
+
+    def events(self, domain: str, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Timestamps of the graph generations recorded for domain, optionally
+        limited to start <= timestamp < end (ISO strings)."""
+        self.load()
+        return [timestamp for _, _, timestamp in self.backend.read_log("stats_events", domain, start, end)]
+
+    def buckets(self, domain: str, bucket: str, start: Optional[str] = None,
+                end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Event counts for domain per bucket ("minute", "hour" or "day"),
+        oldest first, for buckets starting in [start, end)."""
+        self.load()
+        width = STATS_BUCKETS[bucket]
+        # Compare at the bucket's precision so a partial bucket at start counts
+        start = start[:width] if start else None
+        counts = self.backend.buckets(f"stats_{bucket}", domain)
+        padding = {"minute": ":00", "hour": ":00:00", "day": "T00:00:00"}[bucket]
+        return [
+            {"start": label + padding, "count": count}
+            for label, count in counts
+            if (start is None or label >= start) and (end is None or label + padding < end)
+        ]
+
+
+stats_store = StatsStore(state_backend)
+
+
+class SpaceSavingSketch:
+    """Approximate counts for the most frequent items of a stream.
+
+    At most capacity items are tracked. An untracked item replaces the one
+    with the lowest count and inherits that count as its possible
+    overcount ("error"), so any item seen more than total/capacity times
+    is guaranteed to be present.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[str, List[int]] = {}
+
+    def add(self, item: str, n: int = 1) -> None:
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = [n, 0]
+        else:
+            evicted = min(self.counts, key=lambda key: self.counts[key][0])
+            floor = self.counts.pop(evicted)[0]
+            self.counts[item] = [floor + n, floor]
+
+
+class TopDomains:
+    """Most requested domains overall and over sliding time windows.
+
+    Each window is split into slots with a sketch per slot; a query merges
+    the sketches of the slots inside the window, so memory and query cost
+    depend on STATS_TOP_CAPACITY rather than on the number of domains seen.
+    The sketches are kept per worker and catch up on the shared event log,
+    including events recorded by other workers, before each query.
+    """
+
+    def __init__(self, backend: StateBackend, capacity: int, windows: Dict[str, Tuple[int, int]]):
+        self.backend = backend
+        self.capacity = capacity
+        self.windows = windows
+        self.lifetime = SpaceSavingSketch(capacity)
+        # window -> deque of (slot start, sketch), oldest first
+        self._slots: Dict[str, deque] = {window: deque() for window in windows}
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._loaded = False
+
+    def load(self) -> None:
+        """Seed the sketches from the stats store if not done yet."""
+        if self._loaded:
+            return
+        stats_store.load()
+        longest = max(span for span, _ in self.windows.values())
+        cutoff = datetime.datetime.utcfromtimestamp(time.time() - longest).isoformat()
+        with self._lock:
+            if self._loaded:
+                return
+            # One snapshot, so the counters and the log position agree
+            with self.backend.snapshot():
+                totals = self.backend.items("stats_domains")
+                events = self.backend.read_log("stats_events", start=cutoff)
+                self._last_id = self.backend.last_id("stats_events")
+            for domain, count in totals:
+                self.lifetime.add(domain, count)
+            for _, domain, timestamp in events:
+                self._add_to_windows(domain, self._epoch(timestamp))
+            self._loaded = True
+
+    @staticmethod
+    def _epoch(timestamp: str) -> float:
+        return datetime.datetime.fromisoformat(timestamp).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    def sync(self) -> None:
+        """Count the events appended to the log since the last sync."""
+        self.load()
+        with self._lock:
+            for event_id, domain, timestamp in self.backend.read_log("stats_events", after=self._last_id):
+                self.lifetime.add(domain)
+                self._add_to_windows(domain, self._epoch(timestamp))
+                self._last_id = event_id
+
+    def _add_to_windows(self, domain: str, when: float) -> None:
+        for window, (span, slots) in self.windows.items():
+            width = span / slots
+            start = when - when % width
+            ring = self._slots[window]
+            if not ring or ring[-1][0] < start:
+                ring.append((start, SpaceSavingSketch(self.capacity)))
+            while ring and ring[0][0] <= when - span - width:
+                ring.popleft()
+            ring[-1][1].add(domain)
+
+    def top(self, k: int, window: str = "all", prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The k domains with the highest estimated counts in window,
+        limited to domains starting with prefix."""
+        self.sync()
+        with self._lock:
+            if window == "all":
+                merged = {domain: list(entry) for domain, entry in self.lifetime.counts.items()}
+            else:
+                span, slots = self.windows[window]
+                since = time.time() - span
+                merged = {}
+                for start, sketch in self._slots[window]:
+                    if start + span / slots <= since:
+                        continue
+                    for domain, (count, error) in sketch.counts.items():
+                        entry = merged.setdefault(domain, [0, 0])
+                        entry[0] += count
+                        entry[1] += error
+        ranked = sorted(
+            ((domain, entry) for domain, entry in merged.items() if not prefix or domain.startswith(prefix)),
+            key=lambda item: -item[1][0],
+        )
+        return [{"domain": domain, "count": count, "error": error} for domain, (count, error) in ranked[:k]]
+
+
+top_domains = TopDomains(state_backend, STATS_TOP_CAPACITY, STATS_TOP_WINDOWS)
+
+
+class RRsetCache:
+    """DNS responses cached by (owner name, record type) until their TTL runs out."""
+
+    def __init__(self, max_entries: int, max_ttl: int, negative_ttl: int):
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = LRUCache(max_entries)
+
+    @staticmethod
+    def make_key(domain: str, record_type: str) -> Tuple[str, str]:
+        return normalize_domain(domain) or '.', record_type.upper()
+
+    def response_ttl(self, response: dns.message.Message) -> int:
+        """Seconds the response stays valid: its shortest answer TTL, or the
+        negative caching TTL from the SOA for NXDOMAIN/NODATA answers."""
+        if response.answer:
+            ttl = min(rrset.ttl for rrset in response.answer)
+        else:
+            ttl = None
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    ttl = min(rrset.ttl, rrset[0].minimum)
+                    break
+            if ttl is None:
+                ttl = self.negative_ttl
+        if self.max_ttl:
+            ttl = min(ttl, self.max_ttl)
+        return ttl
+
+    def get(self, domain: str, record_type: str) -> Optional[dns.message.Message]:
+        """Return a cached response that has not yet expired."""
+        key = self.make_key(domain, record_type)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, response = entry
+        if time.time() >= expires:
+            self._entries.pop(key)
+            return None
+        return response
+
+    def discard(self, domain: str, record_types: Iterable[str]) -> None:
+        """Drop the cached responses for domain so the next query refetches them."""
+        for record_type in record_types:
+            self._entries.pop(self.make_key(domain, record_type))
+
+    def set(self, domain: str, record_type: str, response: dns.message.Message) -> None:
+        """Cache a response for the lifetime of its records."""
+        if response.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            return
+        if response.flags & dns.flags.TC:
+            # A truncated answer may be missing records
+            return
+        ttl = self.response_ttl(response)
+        if ttl > 0:
+            self._entries.set(self.make_key(domain, record_type), (time.time() + ttl, response))
+
+
+rrset_cache = RRsetCache(RRSET_CACHE_MAX_ENTRIES, RRSET_CACHE_MAX_TTL, RRSET_CACHE_NEGATIVE_TTL)
+
+
+class LevelSnapshotStore:
+    """Shared copies of the root and TLD chain levels.
+
+    Most analyses share these levels, so build_chain_of_trust splices a
+    snapshot in instead of querying them again. Once a snapshot is older
+    than refresh_at of its lifetime the next reader refreshes it in the
+    background while still using the current copy. A level whose DNSKEY or
+    NS lookup got no answer is only kept for failure_ttl seconds.
+    """
+
+    def __init__(self, refresh_at: float, max_ttl: int, failure_ttl: int):
+        self.refresh_at = refresh_at
+        self.max_ttl = max_ttl
+        self.failure_ttl = failure_ttl
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_shared_level(domain_str: str) -> bool:
+        """Only the root and top-level domains are snapshotted."""
+        return domain_str == '.' or '.' not in domain_str
+
+    def get(self, domain_str: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Return (level, needs_refresh); level is None when missing or expired."""
+        with self._lock:
+            snapshot = self._snapshots.get(domain_str)
+        if snapshot is None:
+            return None, False
+        now = time.time()
+        if now >= snapshot["expires"]:
+            return None, False
+        lifetime = snapshot["expires"] - snapshot["fetched"]
+        return snapshot["level"], now >= snapshot["fetched"] + lifetime * self.refresh_at
+
+    @staticmethod
+    def is_answered(level: Dict[str, Any]) -> bool:
+        """False when the level's DNSKEY or NS lookup failed: no NS records,
+        the root's fallback keys, or no keys for a zone with a DS."""
+        keys = level["dnskey_records"]
+        if not level["ns_records"] or keys is FALLBACK_ROOT_KEYS:
+            return False
+        return bool(keys) or not level["ds_records"]
+
+    def set(self, domain_str: str, level: Dict[str, Any]) -> None:
+        """Store a freshly fetched level until its shortest record TTL."""
+        now = time.time()
+        if self.is_answered(level):
+            ttl = min_record_ttl((level[field] for field, _ in LEVEL_FETCHERS), self.max_ttl)
+        else:
+            ttl = self.failure_ttl
+        with self._lock:
+            self._snapshots[domain_str] = {"level": level, "fetched": now, "expires": now + ttl}
+            self._refreshing.discard(domain_str)
+
+    def claim_refresh(self, domain_str: str) -> bool:
+        """Return True if the caller should refresh domain_str (once per cycle)."""
+        with self._lock:
+            if domain_str in self._refreshing:
+                return False
+            self._refreshing.add(domain_str)
+            return True
+
+    def release_refresh(self, domain_str: str) -> None:
+        """Allow another refresh attempt after one failed."""
+        with self._lock:
+            self._refreshing.discard(domain_str)
+
+
+level_snapshots = LevelSnapshotStore(LEVEL_SNAPSHOT_REFRESH_AT, CHAIN_CACHE_MAX_TTL, RRSET_CACHE_NEGATIVE_TTL)
+
+
+def chain_cache_key(domain: str, profile: str = "full") -> str:
+    """Chain cache key for an analysis of domain made with profile.
+
+    Full analyses keep the bare domain as their key."""
+    domain = normalize_domain(domain)
+    return domain if profile == "full" else f"{domain}|{profile}"
+
+
+def get_cached_chain(domain: str, profile: str = "full") -> Optional[Dict[str, Any]]:
+    """Retrieve cached chain data from the chain cache."""
+    entry = chain_cache.get(chain_cache_key(domain, profile))
+    return entry.get("data") if entry else None
+
+
+def min_record_ttl(values: Iterable[Any], ttl: int) -> int:
+    """Lower ttl to the shortest positive 'ttl' among the record dicts (or
+    lists of record dicts) in values."""
+    for value in values:
+        records = value if isinstance(value, list) else [value]
+        for record in records:
+            if isinstance(record, dict) and record.get("ttl"):
+                ttl = min(ttl, int(record["ttl"]))
+    return ttl
+
+
+def chain_ttl(result: Dict[str, Any], max_ttl: int = CHAIN_CACHE_MAX_TTL) -> int:
+    """Cache lifetime for an analysis: the shortest TTL among its records."""
+    ttl = float("inf")
+    for level in result.get("levels", []):
+        ttl = min_record_ttl(level.get("records", {}).values(), ttl)
+    # Retry failed and partial analyses, and ones where no record answered,
+    # soon rather than serving the gaps for hours
+    if ttl == float("inf") or not result.get("success") or result.get("metadata", {}).get("incomplete"):
+        ttl = min(ttl, CHAIN_INCOMPLETE_TTL)
+    return int(min(ttl, max_ttl))
+
+
+def get_cached_chain_or_stale(domain: str, profile: str = "full") -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Retrieve cached chain data, including expired data still inside the
+    stale grace window. Returns (data, stale)."""
+    entry, stale = chain_cache.lookup(chain_cache_key(domain, profile))
+    return (entry.get("data"), stale) if entry else (None, False)
+
+
+def compact_level(level_obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a level object with its key material stored once.
+
+    Each DNSKEY keeps a single unwrapped base64 'key_data' in place of
+    'key_data_b64' and 'key_data_hex', and key_hierarchy lists KSK/ZSK key
+    tags instead of copies of the keys. expand_level reverses this.
+    """
+    hierarchy = level_obj.get("key_hierarchy", {})
+    if "ksk_keys" not in hierarchy:
+        return level_obj
+    records = level_obj.get("records", {})
+    dnskeys = []
+    for key in records.get("dnskey_records", []):
+        compact = {k: v for k, v in key.items() if k not in ("key_data_b64", "key_data_hex")}
+        compact["key_data"] = "".join(key.get("key_data_b64", "").split())
+        dnskeys.append(compact)
+    hierarchy = {k: v for k, v in hierarchy.items() if k not in ("ksk_keys", "zsk_keys")}
+    hierarchy["ksk_key_tags"] = [key["key_tag"] for key in dnskeys if key["is_ksk"]]
+    hierarchy["zsk_key_tags"] = [key["key_tag"] for key in dnskeys if key["is_zsk"]]
+    return {**level_obj, "key_hierarchy": hierarchy, "records": {**records, "dnskey_records": dnskeys}}
+
+
+def expand_level(level_obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a compact level object with the display encodings restored."""
+    hierarchy = level_obj.get("key_hierarchy", {})
+    if "ksk_key_tags" not in hierarchy:
+        return level_obj
+    records = level_obj.get("records", {})
+    dnskeys = []
+    for key in records.get("dnskey_records", []):
+        key = dict(key)
+        raw = base64.b64decode(key.pop("key_data", ""))
+        key["key_data_b64"] = analyzer_service.analyzer.format_key_data(raw)
+        key["key_data_hex"] = binascii.hexlify(raw).decode().upper()
+        dnskeys.append(key)
+    hierarchy = {k: v for k, v in hierarchy.items() if k not in ("ksk_key_tags", "zsk_key_tags")}
+    hierarchy["ksk_keys"] = [key for key in dnskeys if key["is_ksk"]]
+    hierarchy["zsk_keys"] = [key for key in dnskeys if key["is_zsk"]]
+    return {**level_obj, "key_hierarchy": hierarchy, "records": {**records, "dnskey_records": dnskeys}}
+
+
+def format_keys(result: Dict[str, Any], keys: str = "full") -> Dict[str, Any]:
+    """Convert every level of an analysis to the "compact" or "full" key form."""
+    if "levels" not in result:
+        return result
+    convert = compact_level if keys == "compact" else expand_level
+    return {**result, "levels": [convert(level_obj) for level_obj in result["levels"]]}
+
+
+def set_cached_chain(domain: str, chain: Dict[str, Any], ttl: int = 3600, profile: str = "full") -> None:
+    """Store chain data, in compact key form, in the chain cache shared by
+    all workers."""
     expires = time.time() + ttl
-    cache = _read_file_cache()
-    cache[key] = {"data": chain, "expires": expires}
-    _write_file_cache(cache)
-with open(DATA_FILE_PATH, "r") as file:
-    for line in file:
-        parts = line.strip().split(":")
-        if len(parts) == 4:
-            uid, name, email, password = parts
-            data.append([uid, name, email, password])
-            next_user_id = max(next_user_id, int(uid) + 1)
-        elif len(parts) == 3:
-            name, email, password = parts
-            uid = str(next_user_id)
-            next_user_id += 1
-            data.append([uid, name, email, password])
-        # Ignore malformed lines
+    entry = {"data": format_keys(chain, "compact"), "expires": expires, "profile": profile}
+    chain_cache.set(chain_cache_key(domain, profile), entry)
+
+
+
+class UserRepository:
+    """User accounts in the state backend, indexed by id and by email.
+
+    Each user is stored under its id in "users", and "user_emails" maps
+    "<email>\\t<zero-padded id>" to the id, so the users of an email are
+    listed oldest first. Ids come from a shared counter, so several worker
+    processes can create users without clashing. data.txt is imported the
+    first time any worker reads the accounts.
+    """
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _load(self) -> None:
+        if self._ready:
+            return
+        with self._ready_lock:
+            if self._ready:
+                return
+            self.backend.import_once("data_txt_imported", self._import_data_file)
+            self._ready = True
+
+    def _import_data_file(self) -> None:
+        """Copy the "id:name:email:password" lines of data.txt, keeping their ids."""
+        if not os.path.exists(DATA_FILE_PATH):
+            return
+        with open(DATA_FILE_PATH, "r") as file:
+            for line in file:
+                parts = line.strip().split(":")
+                if len(parts) == 4:
+                    uid, name, email, password = parts
+                    uid = int(uid)
+                    if self.backend.get("users", str(uid)) is None:
+                        self._store(uid, name, email, password)
+                    if uid > self.backend.get("meta", "last_user_id", 0):
+                        self.backend.put("meta", "last_user_id", uid)
+                elif len(parts) == 3:
+                    name, email, password = parts
+                    self._store(self.backend.incr("meta", "last_user_id"), name, email, password)
+                # Ignore malformed lines
+
+    def _store(self, uid: int, name: str, email: str, password: str) -> None:
+        self.backend.put("users", str(uid), {"name": name, "email": email, "password": password})
+        self.backend.put("user_emails", f"{email}\t{uid:012d}", uid)
+
+    def _with_email(self, email: str) -> List[Dict[str, Any]]:
+        """Users registered with email, oldest first."""
+        self._load()
+        with self.backend.snapshot():
+            return [
+                self._as_user(uid, self.backend.get("users", str(uid)))
+                for _, uid in self.backend.items("user_emails", f"{email}\t")
+            ]
+
+    def find_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """The earliest user registered with email, if any."""
+        matches = self._with_email(email)
+        return matches[0] if matches else None
+
+    def find_by_login(self, email: str, password: str) -> Optional[Dict[str, Any]]:
+        """The earliest user with this email and password, if any."""
+        for user in self._with_email(email):
+            if user["password"] == password:
+                return user
+        return None
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        try:
+            uid = int(uid)
+        except ValueError:
+            return None
+        self._load()
+        record = self.backend.get("users", str(uid))
+        return self._as_user(uid, record) if record else None
+
+    def create(self, name: str, email: str, password: str = "") -> str:
+        """Add a user and return its new id."""
+        self._load()
+        with self.backend.transaction():
+            uid = self.backend.incr("meta", "last_user_id")
+            self._store(uid, name, email, password)
+        return str(uid)
+
+    @staticmethod
+    def _as_user(uid: int, record: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": str(uid), **record}
+
+
+users = UserRepository(state_backend)
+
+
+class BlogPostStore:
+    """Blog posts in the state backend, keyed by id. blog_posts.json is
+    imported the first time any worker reads them."""
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+        self._loaded = False
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self.backend.import_once("blog_posts_imported", self._import_file)
+        self._loaded = True
+
+    def _import_file(self) -> None:
+        for post in _read_blog_posts():
+            self.backend.put("posts", post["id"], post)
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Every post, newest first."""
+        self.load()
+        posts = [post for _, post in self.backend.items("posts")]
+        return sorted(posts, key=lambda post: post.get("date", ""), reverse=True)
+
+    def get(self, post_id: str) -> Optional[Dict[str, Any]]:
+        self.load()
+        return self.backend.get("posts", post_id)
+
+    def add(self, post: Dict[str, Any]) -> None:
+        self.load()
+        self.backend.put("posts", post["id"], post)
+
+
+blog_posts = BlogPostStore(state_backend)
 
 GOOGLE_CLIENT_ID = '376144524625-v49q48ldo2lm4q6nvtoumehm1s4m7gdr.apps.googleusercontent.com'
+
+def split_upstream(server: str) -> Tuple[str, int]:
+    """Split an "ip" or "ip#port" upstream into address and port."""
+    host, _, port = server.partition('#')
+    return host, int(port) if port else 53
+
+
+class UpstreamPool:
+    """Health and latency tracking for the recursive resolvers.
+
+    Servers are ranked by smoothed round trip time (RFC 6298 style), so the
+    fastest healthy resolver is asked first. A server that fails is moved
+    into a penalty box for penalty seconds and only tried after the healthy
+    ones. Per-attempt timeouts follow each server's observed latency, and
+    recent RTT samples give the delay after which a query is hedged.
+    """
+
+    def __init__(self, servers: List[str], max_timeout: float, min_timeout: float, penalty: float,
+                 hedge_percentile: float = 95, samples: int = 200):
+        self.servers = list(servers)
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.penalty = penalty
+        self.hedge_percentile = hedge_percentile
+        self.hedges = {"queries": 0, "fired": 0, "won": 0}
+        self._stats = {
+            server: {
+                "srtt": None,
+                "rttvar": None,
+                "successes": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "penalized_until": 0.0,
+                "samples": deque(maxlen=samples),
+            }
+            for server in self.servers
+        }
+        self._lock = threading.Lock()
+
+    def ranked(self) -> List[str]:
+        """Servers in the order they should be tried."""
+        now = time.time()
+        with self._lock:
+            healthy = [s for s in self.servers if self._stats[s]["penalized_until"] <= now]
+            penalized = [s for s in self.servers if self._stats[s]["penalized_until"] > now]
+            # Servers without samples sort first so each one gets measured
+            healthy.sort(key=lambda s: self._stats[s]["srtt"] or 0.0)
+            penalized.sort(key=lambda s: self._stats[s]["penalized_until"])
+        return healthy + penalized
+
+    def timeout_for(self, server: str) -> float:
+        """Per-attempt timeout: srtt + 4 * rttvar, clamped to the configured range."""
+        with self._lock:
+            stats = self._stats[server]
+            if stats["srtt"] is None:
+                return self.max_timeout
+            timeout = stats["srtt"] + 4 * stats["rttvar"]
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def hedge_delay(self, server: str) -> float:
+        """How long to wait on server before hedging: the configured
+        percentile of its recent RTTs, or its timeout until enough samples."""
+        with self._lock:
+            samples = sorted(self._stats[server]["samples"])
+        if len(samples) < 10:
+            return self.timeout_for(server)
+        rank = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return max(samples[rank], 0.001)
+
+    def record_hedge(self, fired: int, won: bool) -> None:
+        with self._lock:
+            self.hedges["queries"] += 1
+            self.hedges["fired"] += fired
+            self.hedges["won"] += int(won)
+
+    def record_success(self, server: str, rtt: float) -> None:
+        with self._lock:
+            stats = self._stats[server]
+            if stats["srtt"] is None:
+                stats["srtt"] = rtt
+                stats["rttvar"] = rtt / 2
+            else:
+                stats["rttvar"] = 0.75 * stats["rttvar"] + 0.25 * abs(stats["srtt"] - rtt)
+                stats["srtt"] = 0.875 * stats["srtt"] + 0.125 * rtt
+            stats["samples"].append(rtt)
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            stats["penalized_until"] = 0.0
+
+    def record_failure(self, server: str) -> None:
+        with self._lock:
+            stats = self._stats[server]
+            stats["failures"] += 1
+            stats["consecutive_failures"] += 1
+            stats["penalized_until"] = time.time() + self.penalty
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            return {
+                server: {
+                    "srtt_ms": round(stats["srtt"] * 1000, 1) if stats["srtt"] is not None else None,
+                    "successes": stats["successes"],
+                    "failures": stats["failures"],
+                    "consecutive_failures": stats["consecutive_failures"],
+                    "penalized": stats["penalized_until"] > now,
+                }
+                for server, stats in self._stats.items()
+            }
+
+
+upstream_pool = UpstreamPool(
+    DNS_UPSTREAMS, DNS_QUERY_TIMEOUT, DNS_QUERY_MIN_TIMEOUT, DNS_UPSTREAM_PENALTY,
+    DNS_HEDGE_PERCENTILE, DNS_HEDGE_SAMPLES,
+)
+
+class StreamConnectionPool:
+    """Persistent TCP (or DNS over TLS) connections per server.
+
+    Used when a UDP answer comes back truncated, so large DNSKEY and TXT
+    sets are fetched in full without a handshake per query. A connection
+    is checked out for one query at a time and returned afterwards; idle
+    connections older than idle_timeout are closed. A reused connection
+    that fails is replaced once, since servers close idle streams.
+    Blocking sockets and asyncio sockets are pooled separately.
+    """
+
+    def __init__(self, use_tls: bool = False, tls_port: int = 853,
+                 max_idle: int = 4, idle_timeout: float = 20):
+        self.use_tls = use_tls
+        self.tls_port = tls_port
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle: Dict[Any, List[Tuple[float, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _ssl_context(self) -> Optional[ssl.SSLContext]:
+        return ssl.create_default_context() if self.use_tls else None
+
+    def _port(self, port: int) -> int:
+        return self.tls_port if self.use_tls and port == 53 else port
+
+    def _checkout(self, key: Any) -> Tuple[List[Any], List[Any]]:
+        """Take the most recently used idle connection for key, and remove
+        the expired ones so the caller can close them."""
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            # Entries are appended on checkin, so expired ones come first
+            expired = 0
+            while expired < len(idle) and now - idle[expired][0] >= self.idle_timeout:
+                expired += 1
+            stale = [sock for _, sock in idle[:expired]]
+            del idle[:expired]
+            reusable = [idle.pop()[1]] if idle else []
+            return reusable, stale
+
+    def _checkin(self, key: Any, sock: Any) -> bool:
+        """Return a connection to the pool; False if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) >= self.max_idle:
+                return False
+            idle.append((time.time(), sock))
+            return True
+
+    def _connect(self, host: str, port: int, timeout: float) -> socket.socket:
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if self.use_tls:
+            sock = self._ssl_context().wrap_socket(sock, server_hostname=host)
+        return sock
+
+    def query(self, query: dns.message.Message, host: str, port: int, timeout: float) -> dns.message.Message:
+        """Send query over a pooled connection, blocking"""
+        port = self._port(port)
+        key = (host, port)
+        reusable, stale = self._checkout(key)
+        for old in stale:
+            old.close()
+        for sock in reusable + [None]:
+            fresh = sock is None
+            if fresh:
+                sock = self._connect(host, port, timeout)
+                self.opened += 1
+            else:
+                self.reused += 1
+            try:
+                response = dns.query.tcp(query, host, timeout=timeout, port=port, sock=sock)
+            except Exception:
+                sock.close()
+                if fresh:
+                    raise
+                continue
+            if not self._checkin(key, sock):
+                sock.close()
+            return response
+
+    async def query_async(self, query: dns.message.Message, host: str, port: int, timeout: float) -> dns.message.Message:
+        """Send query over a pooled connection on the running event loop"""
+        port = self._port(port)
+        key = (asyncio.get_running_loop(), host, port)
+        reusable, stale = self._checkout(key)
+        for old in stale:
+            await old.close()
+        backend = dns.asyncbackend.get_backend('asyncio')
+        for sock in reusable + [None]:
+            fresh = sock is None
+            if fresh:
+                af = socket.AF_INET6 if ':' in host else socket.AF_INET
+                sock = await backend.make_socket(
+                    af, socket.SOCK_STREAM, 0, None, (host, port), timeout,
+                    self._ssl_context(), host if self.use_tls else None,
+                )
+                self.opened += 1
+            else:
+                self.reused += 1
+            try:
+                response = await dns.asyncquery.tcp(query, host, timeout=timeout, port=port, sock=sock)
+            except Exception:
+                await sock.close()
+                if fresh:
+                    raise
+                continue
+            if not self._checkin(key, sock):
+                await sock.close()
+            return response
+
+    def close(self) -> None:
+        """Close every idle blocking connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for key, socks in idle.items():
+            for _, sock in socks:
+                if isinstance(sock, socket.socket):
+                    sock.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            idle = sum(len(socks) for socks in self._idle.values())
+        return {"transport": "tls" if self.use_tls else "tcp", "opened": self.opened,
+                "reused": self.reused, "idle": idle}
+
+
+# Streams to the upstream resolvers, and to authoritative servers in iterative mode
+upstream_streams = StreamConnectionPool(
+    DNS_STREAM_TRANSPORT == "tls", DNS_TLS_PORT, DNS_STREAM_MAX_IDLE, DNS_STREAM_IDLE_TIMEOUT,
+)
+authoritative_streams = StreamConnectionPool(False, DNS_TLS_PORT, DNS_STREAM_MAX_IDLE, DNS_STREAM_IDLE_TIMEOUT)
+
+
+def send_query(query: dns.message.Message, server: str, timeout: float,
+               streams: StreamConnectionPool) -> dns.message.Message:
+    """Send query to server ("ip" or "ip#port") over UDP, retrying over a
+    pooled TCP/TLS connection when the answer is truncated."""
+    host, port = split_upstream(server)
+    try:
+        return dns.query.udp(query, host, port=port, timeout=timeout, raise_on_truncation=True)
+    except dns.message.Truncated:
+        return streams.query(query, host, port, timeout)
+
+
+async def send_query_async(query: dns.message.Message, server: str, timeout: float,
+                           streams: StreamConnectionPool) -> dns.message.Message:
+    """Asyncio counterpart of send_query."""
+    host, port = split_upstream(server)
+    try:
+        return await dns.asyncquery.udp(query, host, port=port, timeout=timeout, raise_on_truncation=True)
+    except dns.message.Truncated:
+        return await streams.query_async(query, host, port, timeout)
+
+
+class IterativeResolver:
+    """Resolve queries by walking the delegation from the root servers.
+
+    Zone cuts learnt from referrals are cached with their nameserver
+    addresses: glue from the additional section when present, otherwise
+    resolved iteratively. A signed referral carries the child's DS RRset,
+    and that RRset is kept as the parent-side DS answer for the child, so
+    DS lookups for zones already walked through need no extra query.
+
+    The walk lives in a generator shared by resolve() and resolve_async();
+    the generator yields the network work it needs done. With root_hints
+    and port pointed at a local authoritative server, the resolver can run
+    against a stand-in hierarchy.
+    """
+
+    MAX_REFERRALS = 30
+    MAX_DEPTH = 4
+
+    def __init__(self, root_hints: List[str], port: int = 53, timeout: float = DNS_QUERY_TIMEOUT):
+        self.root_hints = list(root_hints)
+        self.port = port
+        self.timeout = timeout
+        # Zone cuts and referral DS answers, bounded like the RRset cache;
+        # the root hints are kept apart so eviction never loses them
+        self._zones = LRUCache(RRSET_CACHE_MAX_ENTRIES)
+        self._referral_ds = LRUCache(RRSET_CACHE_MAX_ENTRIES)
+
+    def _server(self, address: str) -> str:
+        return address if self.port == 53 else f"{address}#{self.port}"
+
+    @staticmethod
+    def _unexpired(entries: LRUCache, name: dns.name.Name, now: float) -> Any:
+        """Value cached for name, dropping the entry if it has expired."""
+        entry = entries.get(name)
+        if entry is None:
+            return None
+        expires, value = entry
+        if now >= expires:
+            entries.pop(name)
+            return None
+        return value
+
+    def closest_zone(self, name: dns.name.Name) -> Tuple[dns.name.Name, List[str]]:
+        """Deepest cached zone cut at or above name and its server addresses."""
+        now = time.time()
+        while name != dns.name.root:
+            servers = self._unexpired(self._zones, name, now)
+            if servers:
+                return name, servers
+            name = name.parent()
+        return dns.name.root, self.root_hints
+
+    def remember_referral(self, child: dns.name.Name, servers: List[str], ns_ttl: int,
+                          response: dns.message.Message) -> None:
+        """Cache a zone cut and any DS RRset the referral carried for it."""
+        now = time.time()
+        ds_response = self._ds_from_referral(child, response)
+        self._zones.set(child, (now + ns_ttl, servers))
+        if ds_response is not None:
+            ttl = rrset_cache.response_ttl(ds_response)
+            self._referral_ds.set(child, (now + ttl, ds_response))
+
+    def referral_ds(self, name: dns.name.Name) -> Optional[dns.message.Message]:
+        """Parent-side DS answer seen in an earlier referral, if still valid."""
+        return self._unexpired(self._referral_ds, name, time.time())
+
+    def _ds_from_referral(self, child: dns.name.Name, response: dns.message.Message) -> Optional[dns.message.Message]:
+        """Build a DS answer for child from the authority section of a referral."""
+        index = ResponseIndex.of(response)
+        if not index.find(dns.rdatatype.DS, 'authority', name=child):
+            return None
+        query = dns.message.make_query(child, dns.rdatatype.DS, want_dnssec=True)
+        ds_response = dns.message.make_response(query)
+        for rrset in response.authority:
+            if rrset.name == child and dns.rdatatype.DS in (rrset.rdtype, rrset.covers):
+                ds_response.answer.append(rrset)
+        return ds_response
+
+    def _find_referral(self, name: dns.name.Name, zone: dns.name.Name,
+                       response: dns.message.Message) -> Optional[dns.rrset.RRset]:
+        """NS RRset delegating name to a zone below zone, if response is a referral."""
+        if response.answer or response.rcode() != dns.rcode.NOERROR:
+            return None
+        for rrset in ResponseIndex.of(response).find(dns.rdatatype.NS, 'authority'):
+            if rrset.name != zone and rrset.name.is_subdomain(zone) and name.is_subdomain(rrset.name):
+                return rrset
+        return None
+
+    def _walk(self, qname: str, record_type: str):
+        """Generator driving one resolution.
+
+        Yields ('ask', servers, query) and expects the response (or None),
+        or ('lookup', ns_names) and expects a list of addresses. Returns the
+        final response, or None if the walk could not complete.
+        """
+        name = dns.name.from_text(qname)
+        rdtype = dns.rdatatype.from_text(record_type)
+        if rdtype == dns.rdatatype.DS:
+            cached = self.referral_ds(name)
+            if cached is not None:
+                return cached
+        # DS records live on the parent side of the zone cut
+        start = name.parent() if rdtype == dns.rdatatype.DS and name != dns.name.root else name
+        zone, servers = self.closest_zone(start)
+        query = dns.message.make_query(name, rdtype, want_dnssec=True)
+        query.flags &= ~dns.flags.RD
+        
+        for _ in range(self.MAX_REFERRALS):
+            response = yield ('ask', servers, query)
+            if response is None:
+                return None
+            ns_rrset = self._find_referral(name, zone, response)
+            if ns_rrset is None:
+                return response
+            
+            # Prefer glue from the additional section; resolve the rest
+            index = ResponseIndex.of(response)
+            addresses = [
+                rdata.address
+                for ns in ns_rrset
+                for rrset in index.find(dns.rdatatype.A, 'additional', name=ns.target)
+                for rdata in rrset
+            ]
+            if not addresses:
+                addresses = yield ('lookup', [str(ns.target) for ns in ns_rrset])
+            if not addresses:
+                return None
+            zone = ns_rrset.name
+            servers = [self._server(address) for address in addresses]
+            self.remember_referral(zone, servers, ns_rrset.ttl, response)
+            if rdtype == dns.rdatatype.DS and zone == name:
+                ds_response = self.referral_ds(name)
+                if ds_response is not None:
+                    return ds_response
+        return None
+
+    def _ask(self, servers: List[str], query: dns.message.Message) -> Optional[dns.message.Message]:
+        for server in servers:
+            try:
+                response = send_query(query, server, budget_timeout(self.timeout), authoritative_streams)
+            except Exception:
+                continue
+            if response.rcode() not in (dns.rcode.SERVFAIL, dns.rcode.REFUSED):
+                return response
+        return None
+
+    async def _ask_async(self, servers: List[str], query: dns.message.Message) -> Optional[dns.message.Message]:
+        for server in servers:
+            try:
+                response = await send_query_async(query, server, budget_timeout(self.timeout), authoritative_streams)
+            except Exception:
+                continue
+            if response.rcode() not in (dns.rcode.SERVFAIL, dns.rcode.REFUSED):
+                return response
+        return None
+
+    @staticmethod
+    def _addresses(response: Optional[dns.message.Message]) -> List[str]:
+        if not response:
+            return []
+        return [rdata.address for rrset in ResponseIndex.of(response).find(dns.rdatatype.A) for rdata in rrset]
+
+    def resolve(self, qname: str, record_type: str, depth: int = 0) -> Optional[dns.message.Message]:
+        """Resolve qname/record_type iteratively, blocking"""
+        walk = self._walk(qname, record_type)
+        try:
+            request = next(walk)
+            while True:
+                if request[0] == 'ask':
+                    reply = self._ask(request[1], request[2])
+                else:
+                    reply = []
+                    if depth < self.MAX_DEPTH:
+                        for ns_name in request[1]:
+                            reply = self._addresses(self.resolve(ns_name, 'A', depth + 1))
+                            if reply:
+                                break
+                request = walk.send(reply)
+        except StopIteration as stop:
+            return stop.value
+
+    async def resolve_async(self, qname: str, record_type: str, depth: int = 0) -> Optional[dns.message.Message]:
+        """Resolve qname/record_type iteratively on the event loop"""
+        walk = self._walk(qname, record_type)
+        try:
+            request = next(walk)
+            while True:
+                if request[0] == 'ask':
+                    reply = await self._ask_async(request[1], request[2])
+                else:
+                    reply = []
+                    if depth < self.MAX_DEPTH:
+                        for ns_name in request[1]:
+                            reply = self._addresses(await self.resolve_async(ns_name, 'A', depth + 1))
+                            if reply:
+                                break
+                request = walk.send(reply)
+        except StopIteration as stop:
+            return stop.value
+
+
+iterative_resolver = IterativeResolver(DNS_ROOT_HINTS, DNS_ITERATIVE_PORT)
+
+
+class BudgetExhausted(Exception):
+    """Raised when a lookup would exceed the current analysis' budget"""
+
+
+class QueryBudget:
+    """Time and query-count budget for one chain analysis.
+
+    Every lookup that misses the RRset cache spends one query; once the
+    count or the time runs out further lookups raise BudgetExhausted and
+    their fields are reported as incomplete. Query timeouts are clipped
+    to the time left so no single lookup outlives the analysis.
+    """
+
+    def __init__(self, seconds: float, max_queries: int):
+        self.deadline = time.monotonic() + seconds
+        self.max_queries = max_queries
+        self.queries = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def spend(self) -> None:
+        with self._lock:
+            if self.queries >= self.max_queries or self.remaining() <= 0:
+                self.skipped += 1
+                raise BudgetExhausted(f"query budget exhausted after {self.queries} queries")
+            self.queries += 1
+
+
+# Budget of the analysis running in the current thread or task, if any
+current_budget: contextvars.ContextVar = contextvars.ContextVar("current_budget", default=None)
+
+
+def spend_query() -> None:
+    """Charge one network lookup to the current analysis' budget"""
+    budget = current_budget.get()
+    if budget is not None:
+        budget.spend()
+
+
+# Set by a record getter's caller to collect the getter's unanswered lookups
+failed_lookups: contextvars.ContextVar = contextvars.ContextVar("failed_lookups", default=None)
+
+
+def note_failed_lookup(domain: str, record_type: str) -> None:
+    """Record that a lookup got no response from any server"""
+    failures = failed_lookups.get()
+    if failures is not None:
+        failures.append((domain, record_type))
+
+
+def run_getter(getter: Callable[[str], Any], domain_str: str) -> Tuple[Any, bool]:
+    """Call a record getter; also return whether any of its lookups failed"""
+    failures = []
+    failed_lookups.set(failures)
+    return getter(domain_str), bool(failures)
+
+
+def budget_timeout(timeout: float) -> float:
+    """Clip a query timeout to the time left in the current analysis"""
+    budget = current_budget.get()
+    return timeout if budget is None else min(timeout, budget.remaining())
+
+# Per-level chain fields and the DNSSECAnalyzer getter that fills each one
+LEVEL_FETCHERS = [
+    ('ds_records', 'get_ds_records'),
+    ('dnskey_records', 'get_dnskey_records'),
+    ('ns_records', 'get_ns_records'),
+    ('soa_record', 'get_soa_records'),
+    ('nsec_records', 'get_nsec_records'),
+    ('a_records', 'get_a_records'),
+    ('aaaa_records', 'get_aaaa_records'),
+    ('mx_records', 'get_mx_records'),
+    ('txt_records', 'get_txt_records'),
+]
+
+# Level field filled for each record type a custom profile may ask for
+PROFILE_RECORD_TYPES = {
+    'DS': 'ds_records',
+    'DNSKEY': 'dnskey_records',
+    'NS': 'ns_records',
+    'SOA': 'soa_record',
+    'NSEC': 'nsec_records',
+    'A': 'a_records',
+    'AAAA': 'aaaa_records',
+    'MX': 'mx_records',
+    'TXT': 'txt_records',
+}
+
+# Analysis profiles and the level fields each one fetches; custom profiles
+# add their record types to the DS and DNSKEY the trust graph needs
+ANALYSIS_PROFILES = {
+    'full': [field for field, _ in LEVEL_FETCHERS],
+    'trust-only': ['ds_records', 'dnskey_records', 'ns_records', 'soa_record'],
+}
+
+
+def resolve_profile(profile: str = 'full', types: Optional[str] = None) -> Tuple[str, List[str]]:
+    """Return (name, fields) for a profile request.
+
+    types is a comma-separated list of record types for the custom profile;
+    custom profiles are named after their sorted types so equal requests
+    share cache entries. Raises ValueError for unknown profiles or types.
+    """
+    if profile in ANALYSIS_PROFILES:
+        return profile, ANALYSIS_PROFILES[profile]
+    if profile != 'custom':
+        raise ValueError(f"Unknown profile {profile!r}")
+    wanted = {'DS', 'DNSKEY'}
+    for rdtype in (types or '').split(','):
+        rdtype = rdtype.strip().upper()
+        if not rdtype:
+            continue
+        if rdtype not in PROFILE_RECORD_TYPES:
+            raise ValueError(f"Unsupported record type {rdtype!r}")
+        wanted.add(rdtype)
+    fields = [field for rdtype, field in PROFILE_RECORD_TYPES.items() if rdtype in wanted]
+    if set(fields) == set(ANALYSIS_PROFILES['full']):
+        return 'full', ANALYSIS_PROFILES['full']
+    return 'custom:' + ','.join(sorted(wanted)), fields
+
+
+def profile_fetchers(fields: Optional[List[str]]) -> List[Tuple[str, str]]:
+    """The LEVEL_FETCHERS entries for fields (all of them for None)"""
+    if fields is None:
+        return LEVEL_FETCHERS
+    return [(field, getter) for field, getter in LEVEL_FETCHERS if field in fields]
+
+
+# Record types queried at a zone's own name by the LEVEL_FETCHERS getters
+SNAPSHOT_RECORD_TYPES = ['DS', 'DNSKEY', 'NS', 'SOA', 'A', 'AAAA', 'MX', 'TXT']
+
+
+def nsec_probe_name(domain: str) -> str:
+    """Name below a zone that should not exist, queried to elicit NSEC/NSEC3 proofs."""
+    return 'nonexistent.' if domain == '.' else f"nonexistent.{domain}"
+
+
+class ResponseIndex:
+    """RRsets of a DNS response indexed in a single pass.
+
+    Each section's RRsets are grouped by type and by (owner name, type),
+    and every RRSIG is recorded against the type it covers, so getters can
+    look up a record set and its signature status without rescanning the
+    message. Use ResponseIndex.of() to build the index at most once per
+    response, which also covers responses served from the RRset cache.
+    """
+
+    SECTIONS = ('answer', 'authority', 'additional')
+
+    def __init__(self, response: dns.message.Message):
+        self.by_type: Dict[Tuple[str, int], List[dns.rrset.RRset]] = {}
+        self.by_name: Dict[Tuple[str, dns.name.Name, int], dns.rrset.RRset] = {}
+        self.signed = set()
+        for section in self.SECTIONS:
+            for rrset in getattr(response, section):
+                if rrset.rdtype == dns.rdatatype.RRSIG:
+                    for rdata in rrset:
+                        # Recorded per owner and under None for "any owner"
+                        self.signed.add((section, rrset.name, rdata.type_covered))
+                        self.signed.add((section, None, rdata.type_covered))
+                    continue
+                self.by_type.setdefault((section, rrset.rdtype), []).append(rrset)
+                self.by_name[(section, rrset.name, rrset.rdtype)] = rrset
+
+    @classmethod
+    def of(cls, response: dns.message.Message) -> "ResponseIndex":
+        """Return the index for response, building it on first use."""
+        index = getattr(response, '_response_index', None)
+        if index is None:
+            index = cls(response)
+            response._response_index = index
+        return index
+
+    def find(self, rdtype: int, section: str = 'answer',
+             name: Optional[dns.name.Name] = None) -> List[dns.rrset.RRset]:
+        """RRsets of rdtype in a section, optionally limited to one owner name."""
+        if name is None:
+            return self.by_type.get((section, rdtype), [])
+        rrset = self.by_name.get((section, name, rdtype))
+        return [rrset] if rrset is not None else []
+
+    def find_any(self, rdtypes: Iterable[int], section: str = 'answer') -> List[dns.rrset.RRset]:
+        """RRsets of any of the given types in a section."""
+        return [rrset for rdtype in rdtypes for rrset in self.find(rdtype, section)]
+
+    def is_signed(self, rdtype: int, section: str = 'answer',
+                  name: Optional[dns.name.Name] = None) -> bool:
+        """Whether an RRSIG covering rdtype (at name, if given) is present."""
+        return (section, name, rdtype) in self.signed
+
+
+# Strong references to fire-and-forget asyncio tasks so they are not collected
+_background_tasks = set()
+
 class DNSSECAnalyzer:
-    def __init__(self):
-        self.resolver = dns.resolver.Resolver()
-        self.resolver.use_edns(0, dns.flags.DO, 4096)
+    def __init__(self, resolution_mode: str = DNS_RESOLUTION_MODE,
+                 iterative: Optional[IterativeResolver] = None):
+        self._resolver = None
+        # "recursive" uses the upstream pool, "iterative" walks from the root
+        self.resolution_mode = resolution_mode
+        self.iterative = iterative or iterative_resolver
+
+    @property
+    def resolver(self) -> dns.resolver.Resolver:
+        """System stub resolver, created on first use since it reads /etc/resolv.conf"""
+        if self._resolver is None:
+            resolver = dns.resolver.Resolver()
+            resolver.use_edns(0, dns.flags.DO, 4096)
+            self._resolver = resolver
+        return self._resolver
         
     def get_algorithm_name(self, alg_num: int) -> str:
         """Convert algorithm number to human-readable name"""
@@ -346,92 +2046,103 @@ class DNSSECAnalyzer:
     
     def query_with_dnssec(self, domain: str, record_type: str) -> Optional[dns.message.Message]:
         """Query DNS with DNSSEC validation"""
+        cached = rrset_cache.get(domain, record_type)
+        if cached is not None:
+            return cached
+        spend_query()
         try:
-            query = dns.message.make_query(domain, record_type, want_dnssec=True)
-            query.flags |= dns.flags.AD
-            
-            # Try multiple nameservers
-            nameservers = ['8.8.8.8', '1.1.1.1', '9.9.9.9']
-            
-            for ns in nameservers:
-                try:
-                    response = dns.query.udp(query, ns, timeout=10)
-                    if response:
-                        return response
-                except Exception:
-                    continue
-                    
-            return None
+            if self.resolution_mode == 'iterative':
+                response = self.iterative.resolve(domain, record_type)
+            else:
+                query = dns.message.make_query(domain, record_type, want_dnssec=True)
+                query.flags |= dns.flags.AD
+                response = self._sequential_query(query)
+            if response:
+                rrset_cache.set(domain, record_type, response)
+            else:
+                note_failed_lookup(domain, record_type)
+            return response
         except Exception as e:
             print(f"Error querying {domain} {record_type}: {e}")
+            note_failed_lookup(domain, record_type)
             return None
     
+    def _sequential_query(self, query: dns.message.Message) -> Optional[dns.message.Message]:
+        """Try the upstreams one at a time, fastest first"""
+        servers = upstream_pool.ranked()
+        for i, ns in enumerate(servers):
+            # The last attempt gets the full timeout
+            full_timeout = upstream_pool.timeout_for(ns) if i < len(servers) - 1 else DNS_QUERY_TIMEOUT
+            timeout = budget_timeout(full_timeout)
+            if timeout <= 0:
+                break
+            started = time.monotonic()
+            try:
+                response = send_query(query, ns, timeout, upstream_streams)
+            except Exception:
+                # A timeout cut short by the analysis deadline says nothing about ns
+                if timeout >= full_timeout:
+                    upstream_pool.record_failure(ns)
+                continue
+            upstream_pool.record_success(ns, time.monotonic() - started)
+            if response:
+                return response
+        return None
+    
     def get_nsec_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get NSEC records for a domain"""
+        return self._parse_nsec_records(domain, self.query_with_dnssec(nsec_probe_name(domain), 'A'))
+
+    def _bitmap_types(self, windows) -> List[str]:
+        """Decode an NSEC/NSEC3 type bitmap into record type names"""
+        types = []
+        for window, bitmap in windows:
+            for i, byte in enumerate(bitmap):
+                for bit in range(8):
+                    if byte & (0x80 >> bit):
+                        types.append(dns.rdatatype.to_text(window * 256 + i * 8 + bit))
+        return types
+
+    def _parse_nsec_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract NSEC/NSEC3 records from the authority section of an NXDOMAIN probe"""
         nsec_records = []
+        seen = set()
         try:
-            # Try both NSEC and NSEC3
-            for record_type in ['NSEC', 'NSEC3']:
-                response = self.query_with_dnssec(domain, record_type)
-                if not response:
-                    continue
+            if not response:
+                return nsec_records
+            
+            # The authority section holds whichever denial of existence the
+            # zone uses
+            index = ResponseIndex.of(response)
+            for rrset in index.find_any((dns.rdatatype.NSEC, dns.rdatatype.NSEC3), 'authority'):
+                record_type = dns.rdatatype.to_text(rrset.rdtype)
+                for rdata in rrset:
+                    key = (record_type, str(rrset.name), rdata.to_text())
+                    if key in seen:
+                        continue
+                    seen.add(key)
                     
-                for rrset in response.answer:
-                    if rrset.rdtype == getattr(dns.rdatatype, record_type):
-                        for rdata in rrset:
-                            if record_type == 'NSEC':
-                                nsec_records.append({
-                                    'type': 'NSEC',
-                                    'next_domain': str(rdata.next),
-                                    'types': [dns.rdatatype.to_text(t) for t in rdata.windows],
-                                    'ttl': rrset.ttl,
-                                    'owner': str(rrset.name)
-                                })
-                            elif record_type == 'NSEC3':
-                                nsec_records.append({
-                                    'type': 'NSEC3',
-                                    'hash_algorithm': rdata.algorithm,
-                                    'flags': rdata.flags,
-                                    'iterations': rdata.iterations,
-                                    'salt': binascii.hexlify(rdata.salt).decode().upper() if rdata.salt else '',
-                                    'next_hashed_owner': binascii.hexlify(rdata.next).decode().upper(),
-                                    'types': [dns.rdatatype.to_text(t) for t in rdata.windows],
-                                    'ttl': rrset.ttl,
-                                    'owner': str(rrset.name)
-                                })
-                                
-            # Also check authority section for NSEC records (common in NXDOMAIN responses)
-            for record_type in ['NSEC', 'NSEC3']:
-                response = self.query_with_dnssec(f"nonexistent.{domain}", 'A')
-                if response and response.authority:
-                    for rrset in response.authority:
-                        if rrset.rdtype == getattr(dns.rdatatype, record_type):
-                            for rdata in rrset:
-                                record_data = {
-                                    'type': record_type,
-                                    'ttl': rrset.ttl,
-                                    'owner': str(rrset.name),
-                                    'source': 'authority_section'
-                                }
-                                
-                                if record_type == 'NSEC':
-                                    record_data.update({
-                                        'next_domain': str(rdata.next),
-                                        'types': [dns.rdatatype.to_text(t) for t in rdata.windows]
-                                    })
-                                elif record_type == 'NSEC3':
-                                    record_data.update({
-                                        'hash_algorithm': rdata.algorithm,
-                                        'flags': rdata.flags,
-                                        'iterations': rdata.iterations,
-                                        'salt': binascii.hexlify(rdata.salt).decode().upper() if rdata.salt else '',
-                                        'next_hashed_owner': binascii.hexlify(rdata.next).decode().upper(),
-                                        'types': [dns.rdatatype.to_text(t) for t in rdata.windows]
-                                    })
-                                
-                                # Avoid duplicates
-                                if record_data not in nsec_records:
-                                    nsec_records.append(record_data)
+                    record_data = {
+                        'type': record_type,
+                        'ttl': rrset.ttl,
+                        'owner': str(rrset.name),
+                        'source': 'authority_section'
+                    }
+                    if record_type == 'NSEC':
+                        record_data.update({
+                            'next_domain': str(rdata.next),
+                            'types': self._bitmap_types(rdata.windows)
+                        })
+                    else:
+                        record_data.update({
+                            'hash_algorithm': rdata.algorithm,
+                            'flags': rdata.flags,
+                            'iterations': rdata.iterations,
+                            'salt': binascii.hexlify(rdata.salt).decode().upper() if rdata.salt else '',
+                            'next_hashed_owner': binascii.hexlify(rdata.next).decode().upper(),
+                            'types': self._bitmap_types(rdata.windows)
+                        })
+                    nsec_records.append(record_data)
                                     
         except Exception as e:
             print(f"Error getting NSEC records for {domain}: {e}")
@@ -440,25 +2151,28 @@ class DNSSECAnalyzer:
     
     def get_ds_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get DS records for a domain"""
+        return self._parse_ds_records(domain, self.query_with_dnssec(domain, 'DS'))
+
+    def _parse_ds_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract DS records from a query response"""
         ds_records = []
         try:
-            response = self.query_with_dnssec(domain, 'DS')
             if not response:
                 return ds_records
                 
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.DS:
-                    for rdata in rrset:
-                        ds_records.append({
-                            'key_tag': rdata.key_tag,
-                            'algorithm': rdata.algorithm,
-                            'algorithm_name': self.get_algorithm_name(rdata.algorithm),
-                            'digest_type': rdata.digest_type,
-                            'digest_type_name': self.get_digest_type_name(rdata.digest_type),
-                            'digest': binascii.hexlify(rdata.digest).decode().upper(),
-                            'ttl': rrset.ttl,
-                            'ttl_human': self.format_ttl(rrset.ttl)
-                        })
+            index = ResponseIndex.of(response)
+            for rrset in index.find(dns.rdatatype.DS):
+                for rdata in rrset:
+                    ds_records.append({
+                        'key_tag': rdata.key_tag,
+                        'algorithm': rdata.algorithm,
+                        'algorithm_name': self.get_algorithm_name(rdata.algorithm),
+                        'digest_type': rdata.digest_type,
+                        'digest_type_name': self.get_digest_type_name(rdata.digest_type),
+                        'digest': binascii.hexlify(rdata.digest).decode().upper(),
+                        'ttl': rrset.ttl,
+                        'ttl_human': self.format_ttl(rrset.ttl)
+                    })
         except Exception as e:
             print(f"Error getting DS records for {domain}: {e}")
         
@@ -507,9 +2221,12 @@ class DNSSECAnalyzer:
     
     def get_dnskey_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get DNSKEY records for a domain"""
+        return self._parse_dnskey_records(domain, self.query_with_dnssec(domain, 'DNSKEY'))
+
+    def _parse_dnskey_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract DNSKEY records from a query response"""
         dnskey_records = []
         try:
-            response = self.query_with_dnssec(domain, 'DNSKEY')
             if not response:
                 # If querying the root zone failed, provide fallback keys so the
                 # frontend can still display the hierarchy.
@@ -517,28 +2234,28 @@ class DNSSECAnalyzer:
                     return FALLBACK_ROOT_KEYS
                 return dnskey_records
                 
+            index = ResponseIndex.of(response)
             # First pass: collect all DNSKEY data
             raw_keys = []
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.DNSKEY:
-                    for rdata in rrset:
-                        key_size = self.get_key_size(rdata.key, rdata.algorithm)
-                        key_tag = dns.dnssec.key_id(rdata)
-                        
-                        raw_keys.append({
-                            'flags': rdata.flags,
-                            'protocol': rdata.protocol,
-                            'algorithm': rdata.algorithm,
-                            'algorithm_name': self.get_algorithm_name(rdata.algorithm),
-                            'key_tag': key_tag,
-                            'key_size': key_size,
-                            'key_data': rdata.key,
-                            'key_data_b64': self.format_key_data(rdata.key),
-                            'key_data_hex': binascii.hexlify(rdata.key).decode().upper(),
-                            'is_sep': bool(rdata.flags & 1),  # Secure Entry Point
-                            'ttl': rrset.ttl,
-                            'ttl_human': self.format_ttl(rrset.ttl)
-                        })
+            for rrset in index.find(dns.rdatatype.DNSKEY):
+                for rdata in rrset:
+                    key_size = self.get_key_size(rdata.key, rdata.algorithm)
+                    key_tag = dns.dnssec.key_id(rdata)
+                    
+                    raw_keys.append({
+                        'flags': rdata.flags,
+                        'protocol': rdata.protocol,
+                        'algorithm': rdata.algorithm,
+                        'algorithm_name': self.get_algorithm_name(rdata.algorithm),
+                        'key_tag': key_tag,
+                        'key_size': key_size,
+                        'key_data': rdata.key,
+                        'key_data_b64': self.format_key_data(rdata.key),
+                        'key_data_hex': binascii.hexlify(rdata.key).decode().upper(),
+                        'is_sep': bool(rdata.flags & 1),  # Secure Entry Point
+                        'ttl': rrset.ttl,
+                        'ttl_human': self.format_ttl(rrset.ttl)
+                    })
             
             # Second pass: determine roles for each key
             for i, key in enumerate(raw_keys):
@@ -574,16 +2291,19 @@ class DNSSECAnalyzer:
     
     def get_ns_records(self, domain: str) -> List[str]:
         """Get NS records for a domain"""
+        return self._parse_ns_records(domain, self.query_with_dnssec(domain, 'NS'))
+
+    def _parse_ns_records(self, domain: str, response: Optional[dns.message.Message]) -> List[str]:
+        """Extract NS records from a query response"""
         ns_records = []
         try:
-            response = self.query_with_dnssec(domain, 'NS')
             if not response:
                 return ns_records
                 
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.NS:
-                    for rdata in rrset:
-                        ns_records.append(str(rdata.target))
+            index = ResponseIndex.of(response)
+            for rrset in index.find(dns.rdatatype.NS):
+                for rdata in rrset:
+                    ns_records.append(str(rdata.target))
         except Exception as e:
             print(f"Error getting NS records for {domain}: {e}")
         
@@ -591,118 +2311,114 @@ class DNSSECAnalyzer:
     
     def get_soa_records(self, domain: str) -> Optional[Dict[str, Any]]:
         """Get SOA record for a domain, including DNSSEC signature status"""
+        return self._parse_soa_records(domain, self.query_with_dnssec(domain, 'SOA'))
+
+    def _parse_soa_records(self, domain: str, response: Optional[dns.message.Message]) -> Optional[Dict[str, Any]]:
+        """Extract the SOA record from a SOA query response"""
         try:
-            response = self.query_with_dnssec(domain, 'SOA')
             if not response:
                 return None
 
-            signed = False
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.RRSIG:
-                    for rdata in rrset:
-                        if rdata.type_covered == dns.rdatatype.SOA:
-                            signed = True
-                            break
-
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.SOA:
-                    rdata = rrset[0]
-                    return {
-                        'mname': str(rdata.mname),
-                        'rname': str(rdata.rname),
-                        'serial': rdata.serial,
-                        'refresh': rdata.refresh,
-                        'retry': rdata.retry,
-                        'expire': rdata.expire,
-                        'minimum': rdata.minimum,
-                        'ttl': rrset.ttl,
-                        'signed': signed,
-                    }
+            index = ResponseIndex.of(response)
+            signed = index.is_signed(dns.rdatatype.SOA)
+
+            for rrset in index.find(dns.rdatatype.SOA):
+                rdata = rrset[0]
+                return {
+                    'mname': str(rdata.mname),
+                    'rname': str(rdata.rname),
+                    'serial': rdata.serial,
+                    'refresh': rdata.refresh,
+                    'retry': rdata.retry,
+                    'expire': rdata.expire,
+                    'minimum': rdata.minimum,
+                    'ttl': rrset.ttl,
+                    'signed': signed,
+                }
         except Exception as e:
             print(f"Error getting SOA record for {domain}: {e}")
 
         return None
 
-    def _get_rrsig_status(self, response, rdatatype_value) -> bool:
-        """Helper to determine if a record type is signed by checking RRSIGs"""
-        try:
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.RRSIG:
-                    for rdata in rrset:
-                        if rdata.type_covered == rdatatype_value:
-                            return True
-        except Exception:
-            pass
-        return False
-
     def get_a_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get A records for a domain with signature info"""
+        return self._parse_a_records(domain, self.query_with_dnssec(domain, 'A'))
+
+    def _parse_a_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract A records from a query response"""
         records = []
         try:
-            response = self.query_with_dnssec(domain, 'A')
             if not response:
                 return records
-            signed = self._get_rrsig_status(response, dns.rdatatype.A)
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.A:
-                    for rdata in rrset:
-                        records.append({'value': str(rdata.address), 'ttl': rrset.ttl, 'signed': signed})
+            index = ResponseIndex.of(response)
+            signed = index.is_signed(dns.rdatatype.A)
+            for rrset in index.find(dns.rdatatype.A):
+                for rdata in rrset:
+                    records.append({'value': str(rdata.address), 'ttl': rrset.ttl, 'signed': signed})
         except Exception as e:
             print(f"Error getting A records for {domain}: {e}")
         return records
 
     def get_aaaa_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get AAAA records for a domain with signature info"""
+        return self._parse_aaaa_records(domain, self.query_with_dnssec(domain, 'AAAA'))
+
+    def _parse_aaaa_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract AAAA records from a query response"""
         records = []
         try:
-            response = self.query_with_dnssec(domain, 'AAAA')
             if not response:
                 return records
-            signed = self._get_rrsig_status(response, dns.rdatatype.AAAA)
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.AAAA:
-                    for rdata in rrset:
-                        records.append({'value': str(rdata.address), 'ttl': rrset.ttl, 'signed': signed})
+            index = ResponseIndex.of(response)
+            signed = index.is_signed(dns.rdatatype.AAAA)
+            for rrset in index.find(dns.rdatatype.AAAA):
+                for rdata in rrset:
+                    records.append({'value': str(rdata.address), 'ttl': rrset.ttl, 'signed': signed})
         except Exception as e:
             print(f"Error getting AAAA records for {domain}: {e}")
         return records
 
     def get_mx_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get MX records for a domain with signature info"""
+        return self._parse_mx_records(domain, self.query_with_dnssec(domain, 'MX'))
+
+    def _parse_mx_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract MX records from a query response"""
         records = []
         try:
-            response = self.query_with_dnssec(domain, 'MX')
             if not response:
                 return records
-            signed = self._get_rrsig_status(response, dns.rdatatype.MX)
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.MX:
-                    for rdata in rrset:
-                        records.append({'value': f"{rdata.preference} {rdata.exchange}", 'ttl': rrset.ttl, 'signed': signed})
+            index = ResponseIndex.of(response)
+            signed = index.is_signed(dns.rdatatype.MX)
+            for rrset in index.find(dns.rdatatype.MX):
+                for rdata in rrset:
+                    records.append({'value': f"{rdata.preference} {rdata.exchange}", 'ttl': rrset.ttl, 'signed': signed})
         except Exception as e:
             print(f"Error getting MX records for {domain}: {e}")
         return records
 
     def get_txt_records(self, domain: str) -> List[Dict[str, Any]]:
         """Get TXT records for a domain with signature info"""
+        return self._parse_txt_records(domain, self.query_with_dnssec(domain, 'TXT'))
+
+    def _parse_txt_records(self, domain: str, response: Optional[dns.message.Message]) -> List[Dict[str, Any]]:
+        """Extract TXT records from a query response"""
         records = []
         try:
-            response = self.query_with_dnssec(domain, 'TXT')
             if not response:
                 return records
-            signed = self._get_rrsig_status(response, dns.rdatatype.TXT)
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.TXT:
-                    for rdata in rrset:
-                        txt = b''.join(rdata.strings).decode(errors='ignore')
-                        records.append({'value': txt, 'ttl': rrset.ttl, 'signed': signed})
+            index = ResponseIndex.of(response)
+            signed = index.is_signed(dns.rdatatype.TXT)
+            for rrset in index.find(dns.rdatatype.TXT):
+                for rdata in rrset:
+                    txt = b''.join(rdata.strings).decode(errors='ignore')
+                    records.append({'value': txt, 'ttl': rrset.ttl, 'signed': signed})
         except Exception as e:
             print(f"Error getting TXT records for {domain}: {e}")
         return records
     
-    def build_chain_of_trust(self, domain: str) -> List[Dict[str, Any]]:
-        """Build the complete DNSSEC chain of trust from root to domain"""
-        # First, build the hierarchy from domain to root
+    def get_hierarchy(self, domain: str) -> List[str]:
+        """Return the zone names from root down to the domain"""
         hierarchy = []
         current_domain = dns.name.from_text(domain)
         
@@ -724,153 +2440,254 @@ class DNSSECAnalyzer:
         
         # Reverse to get root -> TLD -> domain order
         hierarchy.reverse()
+        return hierarchy
+
+    def make_level(self, domain_str: str, records: Dict[str, Any],
+                   fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Assemble a chain level from fetched records, filling in any gaps.
+
+        fields lists the fields the profile asked for (None for all); only
+        those are reported as incomplete when missing, that is when their
+        lookup was skipped, missed the deadline or got no answer.
+        """
+        level = {
+            'domain': domain_str,
+            'display_name': 'ROOT' if domain_str == '.' else domain_str,
+        }
+        for field, _ in LEVEL_FETCHERS:
+            level[field] = records.get(field, None if field == 'soa_record' else [])
+        # Fields whose lookup was skipped, missed the deadline or went unanswered
+        level['incomplete'] = [field for field, _ in profile_fetchers(fields) if field not in records]
+        return level
+
+    def fetch_levels(self, names: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Run the record getters for fields (all by default) for the given
+        zones concurrently.
+
+        Returns the fetched fields per zone; fields whose lookup missed the
+        deadline are left out.
+        """
+        # Issue every lookup for every level at once; each getter blocks on
+        # its own round trip so the pool keeps CHAIN_FETCH_WORKERS in flight.
+        records = {domain_str: {} for domain_str in names}
+        if not names:
+            return records
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=CHAIN_FETCH_WORKERS)
+        try:
+            for domain_str in names:
+                for field, getter in profile_fetchers(fields):
+                    # Run in a copy of this context so the getters see the budget
+                    future = executor.submit(contextvars.copy_context().run, run_getter,
+                                             getattr(self, getter), domain_str)
+                    futures[future] = (domain_str, field)
+            
+            budget = current_budget.get()
+            deadline = CHAIN_FETCH_DEADLINE if budget is None else budget.remaining()
+            done, not_done = wait(futures, timeout=deadline)
+            if not_done:
+                print(f"Deadline reached for {', '.join(names)}: skipped {len(not_done)} lookups")
+            for future in done:
+                domain_str, field = futures[future]
+                try:
+                    value, failed = future.result()
+                    # Fields whose lookups got no answer are left out as incomplete
+                    if not failed:
+                        records[domain_str][field] = value
+                except BudgetExhausted:
+                    pass
+                except Exception as e:
+                    print(f"Error fetching {field} for {domain_str}: {e}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        chain = []
+        return records
+
+    def store_snapshot(self, domain_str: str, records: Dict[str, Any],
+                       fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Build a level and share it if it is a complete root/TLD level"""
+        level = self.make_level(domain_str, records, fields)
+        if LevelSnapshotStore.is_shared_level(domain_str) and len(records) == len(LEVEL_FETCHERS):
+            level_snapshots.set(domain_str, level)
+        return level
+
+    def use_snapshots(self, hierarchy: List[str]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """Split the hierarchy into snapshotted levels and zones still to fetch.
+
+        Also returns the snapshotted zones that are due for a refresh.
+        """
+        levels = {}
+        due = []
         for domain_str in hierarchy:
             print(f"Analyzing: {domain_str if domain_str != '.' else 'ROOT'}")
-            
-            # Get all relevant records
-            ds_records = self.get_ds_records(domain_str)
-            dnskey_records = self.get_dnskey_records(domain_str)
-            ns_records = self.get_ns_records(domain_str)
-            soa_record = self.get_soa_records(domain_str)
-            nsec_records = self.get_nsec_records(domain_str)
-            a_records = self.get_a_records(domain_str)
-            aaaa_records = self.get_aaaa_records(domain_str)
-            mx_records = self.get_mx_records(domain_str)
-            txt_records = self.get_txt_records(domain_str)
-            
-            chain.append({
-                'domain': domain_str,
-                'display_name': 'ROOT' if domain_str == '.' else domain_str,
-                'ds_records': ds_records,
-                'dnskey_records': dnskey_records,
-                'ns_records': ns_records,
-                'soa_record': soa_record,
-                'nsec_records': nsec_records,
-                'a_records': a_records,
-                'aaaa_records': aaaa_records,
-                'mx_records': mx_records,
-                'txt_records': txt_records
-            })
+            if not LevelSnapshotStore.is_shared_level(domain_str):
+                continue
+            level, needs_refresh = level_snapshots.get(domain_str)
+            if level is None:
+                continue
+            levels[domain_str] = level
+            if needs_refresh and level_snapshots.claim_refresh(domain_str):
+                due.append(domain_str)
+        return levels, due
+
+    def refresh_snapshot(self, domain_str: str) -> None:
+        """Refetch a shared level from the network and replace its snapshot"""
+        try:
+            rrset_cache.discard(domain_str, SNAPSHOT_RECORD_TYPES)
+            rrset_cache.discard(nsec_probe_name(domain_str), ['A'])
+            records = self.fetch_levels([domain_str])[domain_str]
+            self.store_snapshot(domain_str, records)
+        except Exception as e:
+            print(f"Error refreshing snapshot for {domain_str}: {e}")
+        finally:
+            level_snapshots.release_refresh(domain_str)
+
+    def build_chain_of_trust(self, domain: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Build the DNSSEC chain of trust from root to domain, fetching only
+        the given level fields (all by default)"""
+        hierarchy = self.get_hierarchy(domain)
+        levels, due = self.use_snapshots(hierarchy)
+        for domain_str in due:
+            threading.Thread(target=self.refresh_snapshot, args=(domain_str,), daemon=True).start()
         
-        return chain
+        missing = [domain_str for domain_str in hierarchy if domain_str not in levels]
+        token = current_budget.set(QueryBudget(CHAIN_FETCH_DEADLINE, CHAIN_QUERY_BUDGET))
+        try:
+            for domain_str, records in self.fetch_levels(missing, fields).items():
+                levels[domain_str] = self.store_snapshot(domain_str, records, fields)
+        finally:
+            current_budget.reset(token)
+        
+        return [levels[domain_str] for domain_str in hierarchy]
     
-    def create_json_output(self, chain: List[Dict[str, Any]], target_domain: str) -> Dict[str, Any]:
-        """Create a comprehensive JSON structure for frontend consumption"""
+    def create_level_object(self, i: int, level: Dict[str, Any], display_names: List[str],
+                            parent_level: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Create the frontend object for one chain level.
+
+        display_names lists every level of the chain, root first; parent_level
+        is the chain entry above this one (None for the root).
+        """
+        domain = level['domain']
+        display_name = level['display_name']
         
-        # Process each level in the chain
-        levels = []
-        for i, level in enumerate(chain):
-            domain = level['domain']
-            display_name = level['display_name']
-            
-            # Determine domain type
+        # Determine domain type
+        domain_type = "root"
+        if domain == '.':
             domain_type = "root"
-            if domain == '.':
-                domain_type = "root"
-            elif i == 1 and len(chain) > 2:
-                domain_type = "tld"
-            elif i == len(chain) - 1 and i > 0:
-                domain_type = "target"
-            else:
-                domain_type = "subdomain"
-            
-            # Calculate DNSSEC status
-            has_ds = bool(level['ds_records'])
-            has_dnskey = bool(level['dnskey_records'])
-            has_nsec = bool(level['nsec_records'])
-            
-            if domain == '.':  # Root zone special case
-                status = "signed" if has_dnskey else "unsigned"
-                status_message = "Root zone is signed (trust anchor)" if has_dnskey else "Root zone DNSKEY not found"
-                status_type = "success" if has_dnskey else "error"
-            elif has_ds and has_dnskey:
-                status = "signed"
-                status_message = "Fully signed with DNSSEC"
-                status_type = "success"
-            elif has_dnskey:
-                status = "partial"
-                status_message = "Has DNSKEY but no DS record (unsigned delegation)"
-                status_type = "warning"
-            elif has_ds:
-                status = "partial"
-                status_message = "Has DS record but no DNSKEY found"
-                status_type = "warning"
-            else:
-                status = "unsigned"
-                status_message = "No DNSSEC records found"
-                status_type = "error"
-            
-            # Add NSEC information to status
-            if has_nsec:
-                status_message += f" (NSEC records present)"
-            
-            # Process DNSKEY records for hierarchy info
-            ksk_keys = [k for k in level['dnskey_records'] if k['is_ksk']]
-            zsk_keys = [k for k in level['dnskey_records'] if k['is_zsk']]
-            
-            # Create level object
-            level_obj = {
-                "id": f"level_{i}",
-                "index": i,
-                "domain": domain,
-                "display_name": display_name,
-                "domain_type": domain_type,
-                "dnssec_status": {
-                    "status": status,
-                    "message": status_message,
-                    "type": status_type,
-                    "has_ds": has_ds,
-                    "has_dnskey": has_dnskey,
-                    "has_nsec": has_nsec
-                },
-                "key_hierarchy": {
-                    "ksk_count": len(ksk_keys),
-                    "zsk_count": len(zsk_keys),
-                    "total_keys": len(level['dnskey_records']),
-                    "ksk_keys": ksk_keys,
-                    "zsk_keys": zsk_keys
-                },
-                "records": {
-                    "ds_records": level['ds_records'],
-                    "dnskey_records": level['dnskey_records'],
-                    "ns_records": level['ns_records'],
-                    "soa_record": level['soa_record'],
-                    "nsec_records": level['nsec_records'],
-                    "a_records": level['a_records'],
-                    "aaaa_records": level['aaaa_records'],
-                    "mx_records": level['mx_records'],
-                    "txt_records": level['txt_records']
-                },
-                "delegation": {
-                    "delegates_to": chain[i + 1]['display_name'] if i < len(chain) - 1 else None,
-                    "delegated_from": chain[i - 1]['display_name'] if i > 0 else None
-                },
-                "chain_break_info": {
-                    "has_chain_break": False,
-                    "break_reason": None,
-                    "nsec_evidence": level['nsec_records'] if level['nsec_records'] else None
-                }
+        elif i == 1 and len(display_names) > 2:
+            domain_type = "tld"
+        elif i == len(display_names) - 1 and i > 0:
+            domain_type = "target"
+        else:
+            domain_type = "subdomain"
+        
+        # Calculate DNSSEC status
+        has_ds = bool(level['ds_records'])
+        has_dnskey = bool(level['dnskey_records'])
+        has_nsec = bool(level['nsec_records'])
+        
+        if domain == '.':  # Root zone special case
+            status = "signed" if has_dnskey else "unsigned"
+            status_message = "Root zone is signed (trust anchor)" if has_dnskey else "Root zone DNSKEY not found"
+            status_type = "success" if has_dnskey else "error"
+        elif has_ds and has_dnskey:
+            status = "signed"
+            status_message = "Fully signed with DNSSEC"
+            status_type = "success"
+        elif has_dnskey:
+            status = "partial"
+            status_message = "Has DNSKEY but no DS record (unsigned delegation)"
+            status_type = "warning"
+        elif has_ds:
+            status = "partial"
+            status_message = "Has DS record but no DNSKEY found"
+            status_type = "warning"
+        else:
+            status = "unsigned"
+            status_message = "No DNSSEC records found"
+            status_type = "error"
+        
+        # Add NSEC information to status
+        if has_nsec:
+            status_message += f" (NSEC records present)"
+        
+        # Process DNSKEY records for hierarchy info
+        ksk_keys = [k for k in level['dnskey_records'] if k['is_ksk']]
+        zsk_keys = [k for k in level['dnskey_records'] if k['is_zsk']]
+        
+        # Create level object
+        level_obj = {
+            "id": f"level_{i}",
+            "index": i,
+            "domain": domain,
+            "display_name": display_name,
+            "domain_type": domain_type,
+            "dnssec_status": {
+                "status": status,
+                "message": status_message,
+                "type": status_type,
+                "has_ds": has_ds,
+                "has_dnskey": has_dnskey,
+                "has_nsec": has_nsec
+            },
+            "key_hierarchy": {
+                "ksk_count": len(ksk_keys),
+                "zsk_count": len(zsk_keys),
+                "total_keys": len(level['dnskey_records']),
+                "ksk_keys": ksk_keys,
+                "zsk_keys": zsk_keys
+            },
+            "records": {
+                "ds_records": level['ds_records'],
+                "dnskey_records": level['dnskey_records'],
+                "ns_records": level['ns_records'],
+                "soa_record": level['soa_record'],
+                "nsec_records": level['nsec_records'],
+                "a_records": level['a_records'],
+                "aaaa_records": level['aaaa_records'],
+                "mx_records": level['mx_records'],
+                "txt_records": level['txt_records']
+            },
+            "incomplete": bool(level.get('incomplete')),
+            "missing_records": level.get('incomplete', []),
+            "delegation": {
+                "delegates_to": display_names[i + 1] if i < len(display_names) - 1 else None,
+                "delegated_from": display_names[i - 1] if i > 0 else None
+            },
+            "chain_break_info": {
+                "has_chain_break": False,
+                "break_reason": None,
+                "nsec_evidence": level['nsec_records'] if level['nsec_records'] else None
             }
+        }
+        
+        # Check for chain breaks
+        if parent_level is not None:  # Not root
+            parent_has_ds = bool(parent_level['ds_records'])
             
-            # Check for chain breaks
-            if i > 0:  # Not root
-                parent_level = chain[i - 1]
-                parent_has_ds = bool(parent_level['ds_records'])
-                
-                if not parent_has_ds and domain != '.':
-                    level_obj["chain_break_info"]["has_chain_break"] = True
-                    level_obj["chain_break_info"]["break_reason"] = "Missing DS record in parent zone"
-                elif not has_dnskey and parent_has_ds:
-                    level_obj["chain_break_info"]["has_chain_break"] = True
-                    level_obj["chain_break_info"]["break_reason"] = "DS record exists but DNSKEY not found"
-            
-            levels.append(level_obj)
+            if not parent_has_ds and domain != '.':
+                level_obj["chain_break_info"]["has_chain_break"] = True
+                level_obj["chain_break_info"]["break_reason"] = "Missing DS record in parent zone"
+            elif not has_dnskey and parent_has_ds:
+                level_obj["chain_break_info"]["has_chain_break"] = True
+                level_obj["chain_break_info"]["break_reason"] = "DS record exists but DNSKEY not found"
         
+        return level_obj
+
+    def create_json_output(self, chain: List[Dict[str, Any]], target_domain: str) -> Dict[str, Any]:
+        """Create a comprehensive JSON structure for frontend consumption"""
+        display_names = [level['display_name'] for level in chain]
+        levels = [
+            self.create_level_object(i, level, display_names, chain[i - 1] if i > 0 else None)
+            for i, level in enumerate(chain)
+        ]
+        return self.assemble_output(levels, target_domain)
+
+    def assemble_output(self, levels: List[Dict[str, Any]], target_domain: str) -> Dict[str, Any]:
+        """Add chain summary, relationships and graph data to level objects"""
         # Calculate summary statistics
-        signed_levels = sum(1 for level in chain if level['dnskey_records'])
-        total_levels = len(chain)
+        signed_levels = sum(1 for level in levels if level['key_hierarchy']['total_keys'])
+        total_levels = len(levels)
         
         # Check for broken chain
         chain_status = "complete"
@@ -931,7 +2748,8 @@ class DNSSECAnalyzer:
                 "chain_length": total_levels,
                 "signed_levels": signed_levels,
                 "chain_status": chain_status,
-                "chain_message": chain_message
+                "chain_message": chain_message,
+                "incomplete": any(level.get('incomplete') for level in levels)
             },
             "chain_summary": {
                 "total_levels": total_levels,
@@ -986,6 +2804,371 @@ class DNSSECAnalyzer:
         
         return result
 
+class AsyncDNSSECAnalyzer(DNSSECAnalyzer):
+    """DNSSECAnalyzer variant that runs its queries on the asyncio event loop"""
+
+    async def query_with_dnssec(self, domain: str, record_type: str) -> Optional[dns.message.Message]:
+        """Query DNS with DNSSEC validation without blocking the event loop"""
+        cached = rrset_cache.get(domain, record_type)
+        if cached is not None:
+            return cached
+        spend_query()
+        try:
+            query = dns.message.make_query(domain, record_type, want_dnssec=True)
+            query.flags |= dns.flags.AD
+            
+            if self.resolution_mode == 'iterative':
+                response = await self.iterative.resolve_async(domain, record_type)
+            elif DNS_HEDGE_ENABLED:
+                response = await self._hedged_query(query)
+            else:
+                response = await self._sequential_query(query)
+            if response:
+                rrset_cache.set(domain, record_type, response)
+            else:
+                note_failed_lookup(domain, record_type)
+            return response
+        except Exception as e:
+            print(f"Error querying {domain} {record_type}: {e}")
+            note_failed_lookup(domain, record_type)
+            return None
+
+    async def _send(self, query: dns.message.Message, ns: str, timeout: float,
+                    clipped: bool = False) -> Optional[dns.message.Message]:
+        """Send query to one upstream, recording the outcome in the pool.
+        clipped means the budget shortened timeout, so a failure is not
+        held against ns."""
+        started = time.monotonic()
+        try:
+            response = await send_query_async(query, ns, timeout, upstream_streams)
+        except Exception:
+            if not clipped:
+                upstream_pool.record_failure(ns)
+            return None
+        upstream_pool.record_success(ns, time.monotonic() - started)
+        return response
+
+    async def _sequential_query(self, query: dns.message.Message) -> Optional[dns.message.Message]:
+        """Try the upstreams one at a time, fastest first"""
+        servers = upstream_pool.ranked()
+        for i, ns in enumerate(servers):
+            # The last attempt gets the full timeout
+            full_timeout = upstream_pool.timeout_for(ns) if i < len(servers) - 1 else DNS_QUERY_TIMEOUT
+            timeout = budget_timeout(full_timeout)
+            if timeout <= 0:
+                break
+            response = await self._send(query, ns, timeout, timeout < full_timeout)
+            if response:
+                return response
+        return None
+
+    async def _hedged_query(self, query: dns.message.Message) -> Optional[dns.message.Message]:
+        """Race the upstreams: if the newest attempt has not answered within its
+        hedge delay (or has failed), send the query to the next upstream too.
+        The first answer wins and the other attempts are cancelled."""
+        servers = upstream_pool.ranked()
+        attempts: Dict[asyncio.Task, str] = {}
+        pending = set()
+        # Attempts started because an earlier one was slow, not because it failed
+        hedges = set()
+
+        def launch() -> Optional[Tuple[str, asyncio.Task]]:
+            """Start the next attempt, or return None when the budget has no time left."""
+            timeout = budget_timeout(DNS_QUERY_TIMEOUT)
+            if timeout <= 0:
+                return None
+            ns = servers.pop(0)
+            task = asyncio.ensure_future(self._send(query, ns, timeout, timeout < DNS_QUERY_TIMEOUT))
+            attempts[task] = ns
+            pending.add(task)
+            return ns, task
+
+        launched = launch() if servers else None
+        if launched is None:
+            return None
+        current, _ = launched
+        try:
+            while pending:
+                delay = upstream_pool.hedge_delay(current) if servers else None
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    response = task.result()
+                    if response:
+                        upstream_pool.record_hedge(len(hedges), task in hedges)
+                        return response
+                if servers and (not done or not pending):
+                    # Hedge on a slow attempt, fail over when all attempts failed
+                    launched = launch()
+                    if launched is None:
+                        servers.clear()
+                        continue
+                    current, task = launched
+                    if not done:
+                        hedges.add(task)
+            upstream_pool.record_hedge(len(hedges), False)
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_nsec_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get NSEC records for a domain"""
+        return self._parse_nsec_records(domain, await self.query_with_dnssec(nsec_probe_name(domain), 'A'))
+
+    async def get_ds_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get DS records for a domain"""
+        return self._parse_ds_records(domain, await self.query_with_dnssec(domain, 'DS'))
+
+    async def get_dnskey_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get DNSKEY records for a domain"""
+        return self._parse_dnskey_records(domain, await self.query_with_dnssec(domain, 'DNSKEY'))
+
+    async def get_ns_records(self, domain: str) -> List[str]:
+        """Get NS records for a domain"""
+        return self._parse_ns_records(domain, await self.query_with_dnssec(domain, 'NS'))
+
+    async def get_soa_records(self, domain: str) -> Optional[Dict[str, Any]]:
+        """Get SOA record for a domain, including DNSSEC signature status"""
+        return self._parse_soa_records(domain, await self.query_with_dnssec(domain, 'SOA'))
+
+    async def get_a_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get A records for a domain with signature info"""
+        return self._parse_a_records(domain, await self.query_with_dnssec(domain, 'A'))
+
+    async def get_aaaa_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get AAAA records for a domain with signature info"""
+        return self._parse_aaaa_records(domain, await self.query_with_dnssec(domain, 'AAAA'))
+
+    async def get_mx_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get MX records for a domain with signature info"""
+        return self._parse_mx_records(domain, await self.query_with_dnssec(domain, 'MX'))
+
+    async def get_txt_records(self, domain: str) -> List[Dict[str, Any]]:
+        """Get TXT records for a domain with signature info"""
+        return self._parse_txt_records(domain, await self.query_with_dnssec(domain, 'TXT'))
+
+    def start_level_fetches(self, names: List[str], fields: Optional[List[str]] = None
+                            ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, asyncio.Future]]:
+        """Start the record getters for fields (all by default) for the given
+        zones concurrently.
+
+        Returns the records dict the getters fill in and one future per zone
+        that completes when all of that zone's getters have finished.
+        """
+        # Same fan-out as the threaded version, bounded by a semaphore
+        # instead of a worker pool.
+        records = {domain_str: {} for domain_str in names}
+        semaphore = asyncio.Semaphore(CHAIN_FETCH_WORKERS)
+
+        async def fetch(domain_str: str, field: str, getter: str) -> None:
+            async with semaphore:
+                # Each fetch runs in its own task, so this only sees its own lookups
+                failures = []
+                failed_lookups.set(failures)
+                value = await getattr(self, getter)(domain_str)
+                if not failures:
+                    records[domain_str][field] = value
+
+        futures = {
+            domain_str: asyncio.gather(
+                *(fetch(domain_str, field, getter) for field, getter in profile_fetchers(fields)),
+                return_exceptions=True,
+            )
+            for domain_str in names
+        }
+        return records, futures
+
+    async def fetch_levels(self, names: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Run the record getters for fields (all by default) for the given
+        zones concurrently"""
+        records, futures = self.start_level_fetches(names, fields)
+        if not futures:
+            return records
+        
+        budget = current_budget.get()
+        deadline = CHAIN_FETCH_DEADLINE if budget is None else budget.remaining()
+        _, pending = await asyncio.wait(futures.values(), timeout=deadline)
+        if pending:
+            skipped = sum(len(profile_fetchers(fields)) - len(fetched) for fetched in records.values())
+            print(f"Deadline reached for {', '.join(names)}: skipped {skipped} lookups")
+            for future in pending:
+                future.cancel()
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        
+        return records
+
+    def schedule_refreshes(self, due: List[str]) -> None:
+        """Refresh snapshots in background tasks"""
+        for domain_str in due:
+            task = asyncio.ensure_future(self.refresh_snapshot(domain_str))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def refresh_snapshot(self, domain_str: str) -> None:
+        """Refetch a shared level from the network and replace its snapshot"""
+        try:
+            rrset_cache.discard(domain_str, SNAPSHOT_RECORD_TYPES)
+            rrset_cache.discard(nsec_probe_name(domain_str), ['A'])
+            records = (await self.fetch_levels([domain_str]))[domain_str]
+            self.store_snapshot(domain_str, records)
+        except Exception as e:
+            print(f"Error refreshing snapshot for {domain_str}: {e}")
+        finally:
+            level_snapshots.release_refresh(domain_str)
+
+    async def prefetch_shared_levels(self, domains: Iterable[str]) -> None:
+        """Fetch the root and TLD levels of many domains once, up front"""
+        zones = set()
+        for domain in domains:
+            try:
+                hierarchy = self.get_hierarchy(domain)
+            except Exception:
+                continue
+            zones.update(z for z in hierarchy if LevelSnapshotStore.is_shared_level(z))
+        missing = sorted(z for z in zones if level_snapshots.get(z)[0] is None)
+        for domain_str, records in (await self.fetch_levels(missing)).items():
+            self.store_snapshot(domain_str, records)
+
+    async def iter_chain_levels(self, domain: str, fields: Optional[List[str]] = None):
+        """Yield the chain levels from root to domain, each one as soon as it
+        and every level above it have been fetched. Only the given level
+        fields are fetched (all by default)."""
+        hierarchy = self.get_hierarchy(domain)
+        levels, due = self.use_snapshots(hierarchy)
+        self.schedule_refreshes(due)
+        
+        missing = [domain_str for domain_str in hierarchy if domain_str not in levels]
+        # The fetch tasks copy this context when they are created, so they
+        # all share the budget without it leaking into the caller's context.
+        budget = QueryBudget(CHAIN_FETCH_DEADLINE, CHAIN_QUERY_BUDGET)
+        context = contextvars.copy_context()
+        context.run(current_budget.set, budget)
+        records, futures = context.run(self.start_level_fetches, missing, fields)
+        try:
+            for domain_str in hierarchy:
+                if domain_str not in levels:
+                    future = futures[domain_str]
+                    await asyncio.wait([future], timeout=budget.remaining())
+                    if not future.done():
+                        skipped = len(profile_fetchers(fields)) - len(records[domain_str])
+                        print(f"Deadline reached for {domain_str}: skipped {skipped} lookups")
+                        future.cancel()
+                    levels[domain_str] = self.store_snapshot(domain_str, records[domain_str], fields)
+                yield levels[domain_str]
+        finally:
+            for future in futures.values():
+                future.cancel()
+                # Consume the CancelledError so it is not logged as unretrieved
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def build_chain_of_trust(self, domain: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Build the DNSSEC chain of trust from root to domain, fetching only
+        the given level fields (all by default)"""
+        return [level async for level in self.iter_chain_levels(domain, fields)]
+
+    async def level_detail(self, domain: str, index: int) -> Dict[str, Any]:
+        """Build the level object for one level of domain's chain.
+
+        The records come through the RRset cache, so levels of a recently
+        analysed chain need no network round trips. Raises IndexError for
+        an index outside the chain.
+        """
+        hierarchy = self.get_hierarchy(domain)
+        if not 0 <= index < len(hierarchy):
+            raise IndexError(f"Level {index} is outside the chain of {len(hierarchy)} levels")
+        display_names = ['ROOT' if domain_str == '.' else domain_str for domain_str in hierarchy]
+        domain_str = hierarchy[index]
+        token = current_budget.set(QueryBudget(CHAIN_FETCH_DEADLINE, CHAIN_QUERY_BUDGET))
+        try:
+            level = self.make_level(domain_str, (await self.fetch_levels([domain_str]))[domain_str])
+            parent_level = None
+            if index > 0:
+                # Chain-break detection only needs the parent's DS records
+                parent = hierarchy[index - 1]
+                fields = ['ds_records']
+                parent_level = self.make_level(parent, (await self.fetch_levels([parent], fields))[parent], fields)
+        finally:
+            current_budget.reset(token)
+        return self.create_level_object(index, level, display_names, parent_level)
+
+
+class AnalyzerService:
+    """The per-process analyzers shared by every chain request.
+
+    The analyzers keep no per-request state, so one sync and one async
+    instance serve all threads and tasks; the caches, upstream pool and
+    stream connections they use live for the life of the process.
+    start() and stop() are tied to FastAPI startup and shutdown, and
+    the analyzers are also created on first use for callers that import
+    this module without running the app.
+    """
+
+    def __init__(self):
+        self._analyzer = None
+        self._async_analyzer = None
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.analyses = 0
+        self.in_progress = 0
+
+    @property
+    def analyzer(self) -> DNSSECAnalyzer:
+        if self._analyzer is None:
+            with self._lock:
+                if self._analyzer is None:
+                    self._analyzer = DNSSECAnalyzer()
+        return self._analyzer
+
+    @property
+    def async_analyzer(self) -> "AsyncDNSSECAnalyzer":
+        if self._async_analyzer is None:
+            with self._lock:
+                if self._async_analyzer is None:
+                    self._async_analyzer = AsyncDNSSECAnalyzer()
+        return self._async_analyzer
+
+    def begin(self) -> None:
+        with self._lock:
+            self.analyses += 1
+            self.in_progress += 1
+
+    def end(self) -> None:
+        with self._lock:
+            self.in_progress -= 1
+
+    def start(self) -> None:
+        """Load the chain cache and warm the root and popular TLD levels."""
+        self.started_at = time.time()
+        chain_cache.load()
+        analyzer = self.analyzer
+
+        def warm() -> None:
+            for domain_str, records in analyzer.fetch_levels(LEVEL_SNAPSHOT_WARM_ZONES).items():
+                analyzer.store_snapshot(domain_str, records)
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def stop(self) -> None:
+        """Purge expired cache entries and close idle connections."""
+        chain_cache.flush()
+        upstream_streams.close()
+        authoritative_streams.close()
+        self.started_at = None
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "resolution_mode": self.analyzer.resolution_mode,
+            "analyses": self.analyses,
+            "in_progress": self.in_progress,
+            "rrset_cache_entries": len(rrset_cache._entries),
+        }
+
+
+analyzer_service = AnalyzerService()
+
+
 def analyze_dnssec_chain(domain: str) -> Dict[str, Any]:
     """
     Main function to analyze DNSSEC chain for a domain.
@@ -1001,8 +3184,12 @@ def analyze_dnssec_chain(domain: str) -> Dict[str, Any]:
         # Normalize domain name
         domain = domain.lower().rstrip('.')
         
-        analyzer = DNSSECAnalyzer()
-        chain = analyzer.build_chain_of_trust(domain)
+        analyzer = analyzer_service.analyzer
+        analyzer_service.begin()
+        try:
+            chain = analyzer.build_chain_of_trust(domain)
+        finally:
+            analyzer_service.end()
         
         if not chain:
             return {
@@ -1023,53 +3210,434 @@ def analyze_dnssec_chain(domain: str) -> Dict[str, Any]:
             "error": str(e),
             "domain": domain
         }
+
+
+async def analyze_dnssec_chain_async(domain: str, profile: str = "full",
+                                     fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Asyncio counterpart of analyze_dnssec_chain used by the HTTP handlers.
+
+    profile and fields come from resolve_profile; the profile name is
+    recorded in the output metadata.
+    """
+    try:
+        # Normalize domain name
+        domain = domain.lower().rstrip('.')
+        
+        analyzer = analyzer_service.async_analyzer
+        analyzer_service.begin()
+        try:
+            chain = await analyzer.build_chain_of_trust(domain, fields)
+        finally:
+            analyzer_service.end()
+        
+        if not chain:
+            return {
+                "success": False,
+                "error": "Could not build chain of trust",
+                "domain": domain
+            }
+        
+        json_data = analyzer.create_json_output(chain, domain)
+        json_data["metadata"]["profile"] = profile
+        json_data["success"] = True
+        
+        return json_data
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "domain": domain
+        }
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls that share a key into one execution.
+
+    The first caller for a key runs the work in a task; callers arriving
+    while it is in flight await the same task instead of starting their own.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        # Shield so a disconnecting client does not cancel the shared work
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def in_flight(self, key: str) -> Optional[asyncio.Task]:
+        """Return the running task for key, if any."""
+        return self._calls.get(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
+
+
+# In-flight chain analyses keyed by normalized domain
+chain_flights = SingleFlight()
+
+
+async def _analyze_and_cache(domain: str, profile: str = "full",
+                             fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    result = await analyze_dnssec_chain_async(domain, profile, fields)
+    await run_in_threadpool(cache_analysis, domain, result, profile)
+    return result
+
+
+def cache_analysis(domain: str, result: Dict[str, Any], profile: str = "full") -> None:
+    """Cache a finished analysis unless it failed or is incomplete and would
+    replace a stale but valid one."""
+    complete = result.get("success") and not result.get("metadata", {}).get("incomplete")
+    if complete or get_cached_chain_or_stale(domain, profile)[0] is None:
+        set_cached_chain(domain, result, chain_ttl(result), profile)
+
+
+def _mark_stale(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a cached analysis flagged as stale in its metadata."""
+    result = dict(result)
+    result["metadata"] = {**result.get("metadata", {}), "stale": True}
+    return result
+
+
+def skeleton_output(result: Dict[str, Any], domain: str) -> Dict[str, Any]:
+    """Copy of an analysis without per-level record detail.
+
+    Each level keeps its status, counts and delegation but drops the
+    records block, key material and NSEC evidence, and links to the
+    /chain/{domain}/level/{index} endpoint that serves them.
+    """
+    if not result.get("success"):
+        return result
+    levels = []
+    for i, level_obj in enumerate(result.get("levels", [])):
+        level_obj = {key: value for key, value in level_obj.items() if key != "records"}
+        level_obj["key_hierarchy"] = {
+            key: value for key, value in level_obj["key_hierarchy"].items()
+            if key not in ("ksk_keys", "zsk_keys")
+        }
+        level_obj["chain_break_info"] = {**level_obj["chain_break_info"], "nsec_evidence": None}
+        level_obj["detail_url"] = f"/chain/{domain}/level/{i}"
+        levels.append(level_obj)
+    return {**result, "levels": levels}
+
+
+async def fetch_chain(domain: str, profile: str = "full",
+                      fields: Optional[List[str]] = None) -> Tuple[Dict[str, Any], bool]:
+    """Return (analysis, from_cache) for a normalized domain, analysing and
+    caching it on a miss. Concurrent misses for a domain share one analysis.
+
+    profile and fields come from resolve_profile. A fresh full analysis
+    answers any profile, since it holds every record type.
+
+    An expired entry inside the stale grace window is returned immediately,
+    flagged as stale, while a background task refreshes it.
+    """
+    key = chain_cache_key(domain, profile)
+    analyse = lambda: _analyze_and_cache(domain, profile, fields)
+    # The chain cache may wait on another worker's write; keep it off the loop
+    result, stale = await run_in_threadpool(get_cached_chain_or_stale, domain, profile)
+    if (result is None or stale) and profile != "full":
+        full = await run_in_threadpool(get_cached_chain, domain)
+        if full is not None:
+            result, stale = full, False
+    if result is not None:
+        if stale:
+            task = asyncio.ensure_future(chain_flights.do(key, analyse))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            chain_cache.stale_served += 1
+            result = _mark_stale(result)
+        return result, True
+    result = await chain_flights.do(key, analyse)
+    return result, False
+
+
 @app.get("/chain/{domain}")
-def get_item(domain: str, user_id: Optional[str] = None, date: Optional[str] = None):
+async def get_item(
+    domain: str,
+    user_id: Optional[str] = None,
+    date: Optional[str] = None,
+    profile: str = "full",
+    types: Optional[str] = None,
+    view: str = "full",
+    keys: str = "full",
+):
+    """Analyse a domain's chain of trust.
+
+    profile is "full" (default), "trust-only" (DS, DNSKEY, NS and SOA) or
+    "custom", which fetches DS, DNSKEY and the comma-separated types.
+    view="skeleton" leaves out the per-level record detail; fetch it with
+    /chain/{domain}/level/{index}. keys="compact" sends each DNSKEY's
+    material once, as base64, with KSK/ZSK listed by key tag.
+    """
     start = time.time()
+    if view not in ("full", "skeleton"):
+        raise HTTPException(status_code=400, detail="view must be full or skeleton")
+    if keys not in ("full", "compact"):
+        raise HTTPException(status_code=400, detail="keys must be full or compact")
+    try:
+        profile, fields = resolve_profile(profile, types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     normalized = normalize_domain(domain)
-    result = get_cached_chain(normalized)
-    from_cache = result is not None
-    if not from_cache:
-        result = analyze_dnssec_chain(normalized)
-        set_cached_chain(normalized, result)
+    result, from_cache = await fetch_chain(normalized, profile, fields)
     append_log("chain", user_id or "", domain, date or "")
     elapsed = int((time.time() - start) * 1000)
     print(f"Chain fetch for {domain} took {elapsed}ms (cached={from_cache})")
-    return result
+    if view == "skeleton":
+        return skeleton_output(format_keys(result, keys), normalized)
+    return format_keys(result, keys)
+
+
+@app.get("/chain/{domain}/level/{index}")
+async def get_level(domain: str, index: int, keys: str = "full"):
+    """Full detail (records, keys, NSEC evidence) for one level of a chain.
+
+    Served from the cached full analysis when there is one, otherwise
+    rebuilt from the per-RRset cache. keys is "full" or "compact" as for
+    /chain/{domain}.
+    """
+    if keys not in ("full", "compact"):
+        raise HTTPException(status_code=400, detail="keys must be full or compact")
+    convert = compact_level if keys == "compact" else expand_level
+    normalized = normalize_domain(domain)
+    cached, _ = await run_in_threadpool(get_cached_chain_or_stale, normalized)
+    if cached is not None and cached.get("success"):
+        levels = cached.get("levels", [])
+        if not 0 <= index < len(levels):
+            raise HTTPException(status_code=404, detail=f"Level {index} not found")
+        return convert(levels[index])
+    try:
+        return convert(await analyzer_service.async_analyzer.level_detail(normalized, index))
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except dns.exception.DNSException as e:
+        # Not a valid domain name (empty or overlong labels)
+        raise HTTPException(status_code=400, detail=f"Invalid domain name: {e}")
+
+
+@app.get("/chain/{domain}/stream")
+async def stream_chain(
+    domain: str,
+    fmt: str = Query("ndjson", alias="format"),
+    user_id: Optional[str] = None,
+    date: Optional[str] = None,
+    keys: str = "full",
+):
+    """Stream a chain analysis level by level.
+
+    Each level object (as in create_json_output) is sent as soon as it is
+    ready, followed by a summary event carrying metadata, chain_summary,
+    relationships and graph_data. format is "ndjson" or "sse"; keys is
+    "full" or "compact" as for /chain/{domain}.
+    """
+    if fmt not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or sse")
+    if keys not in ("full", "compact"):
+        raise HTTPException(status_code=400, detail="keys must be full or compact")
+    convert = compact_level if keys == "compact" else expand_level
+    normalized = normalize_domain(domain)
+    append_log("chain", user_id or "", domain, date or "")
+
+    def encode(event: str, payload: Dict[str, Any]) -> str:
+        if fmt == "sse":
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps({"type": event, **payload}) + "\n"
+
+    def summary(result: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in result.items() if key != "levels"}
+
+    async def stream():
+        cached = await run_in_threadpool(get_cached_chain, normalized)
+        if cached is None and chain_flights.in_flight(normalized) is not None:
+            # Another request is already analysing this domain; replay its result
+            cached, _ = await fetch_chain(normalized)
+        if cached is not None:
+            for level_obj in cached.get("levels", []):
+                yield encode("level", {"level": convert(level_obj)})
+            yield encode("summary", summary(cached))
+            return
+
+        analyzer = analyzer_service.async_analyzer
+        analyzer_service.begin()
+        try:
+            display_names = [
+                'ROOT' if domain_str == '.' else domain_str
+                for domain_str in analyzer.get_hierarchy(normalized)
+            ]
+            chain = []
+            level_objs = []
+            async for level in analyzer.iter_chain_levels(normalized):
+                i = len(chain)
+                level_obj = analyzer.create_level_object(i, level, display_names, chain[i - 1] if i > 0 else None)
+                chain.append(level)
+                level_objs.append(level_obj)
+                yield encode("level", {"level": convert(level_obj)})
+            result = analyzer.assemble_output(level_objs, normalized)
+            result["success"] = True
+        except Exception as e:
+            result = {"success": False, "error": str(e), "domain": normalized}
+        finally:
+            analyzer_service.end()
+        await run_in_threadpool(cache_analysis, normalized, result)
+        yield encode("summary", summary(result))
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+
+class ChainBatchRequest(BaseModel):
+    domains: List[str]
+    user_id: Optional[str] = None
+    keys: str = "full"
+
+
+@app.post("/chain/batch")
+async def get_chain_batch(payload: ChainBatchRequest):
+    """Analyse many domains concurrently, streaming one NDJSON line per domain
+    as soon as its analysis finishes."""
+    domains = list(dict.fromkeys(normalize_domain(d) for d in payload.domains if d.strip()))
+    if len(domains) > CHAIN_BATCH_MAX_DOMAINS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {CHAIN_BATCH_MAX_DOMAINS} domains per batch",
+        )
+    if payload.keys not in ("full", "compact"):
+        raise HTTPException(status_code=400, detail="keys must be full or compact")
+
+    async def stream():
+        async def prefetch() -> None:
+            # Resolve the ancestors every uncached domain shares (root, TLDs)
+            # once so the per-domain analyses only fetch their own labels.
+            uncached = await run_in_threadpool(lambda: [d for d in domains if get_cached_chain(d) is None])
+            await analyzer_service.async_analyzer.prefetch_shared_levels(uncached)
+
+        semaphore = asyncio.Semaphore(CHAIN_BATCH_CONCURRENCY)
+
+        async def analyse(domain: str) -> Dict[str, Any]:
+            # Cached (or stale) chains go out at once; only analyses wait
+            # for the shared levels
+            cached, _ = await run_in_threadpool(get_cached_chain_or_stale, domain, "full")
+            if cached is None:
+                await asyncio.shield(shared)
+            async with semaphore:
+                result, from_cache = await fetch_chain(domain)
+            append_log("chain", payload.user_id or "", domain, "")
+            return {"domain": domain, "cached": from_cache, "result": format_keys(result, payload.keys)}
+
+        shared = asyncio.ensure_future(prefetch())
+        tasks = [asyncio.ensure_future(analyse(d)) for d in domains]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield json.dumps(await future) + "\n"
+        finally:
+            # The client went away: stop the analyses nobody will read
+            for task in [shared, *tasks]:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/diagnostics")
+def get_diagnostics():
+    """Return counters describing the chain analysis pipeline."""
+    return {
+        "analyzer": analyzer_service.state(),
+        "chain_requests": chain_flights.stats(),
+        "upstreams": upstream_pool.stats(),
+        "hedging": {"enabled": DNS_HEDGE_ENABLED, **upstream_pool.hedges},
+        "streams": {
+            "upstream": upstream_streams.stats(),
+            "authoritative": authoritative_streams.stats(),
+        },
+        "chain_cache": {
+            "entries": len(chain_cache._entries),
+            "stale_served": chain_cache.stale_served,
+        },
+    }
+
+
+def load_stats() -> None:
+    """Import the stats files if needed and seed the top domain sketches."""
+    stats_store.load()
+    top_domains.load()
 
 
 @app.post("/stats/{domain}")
 def record_stat(domain: str):
     """Record a graph generation event for global statistics."""
-    stats = _read_stats()
-    stats["total"] = stats.get("total", 0) + 1
-    stats.setdefault("domains", {})
-    stats["domains"][domain] = stats["domains"].get(domain, 0) + 1
-    _write_stats(stats)
-    history = _read_stats_history()
-    history.setdefault(domain, []).append(datetime.datetime.utcnow().isoformat())
-    _write_stats_history(history)
+    stats_store.record(domain)
     return {"success": True}
 
 
 @app.get("/stats/history/{domain}")
-def get_domain_history(domain: str):
-    """Return timestamp history for a specific domain."""
-    history = _read_stats_history()
-    return {"domain": domain, "events": history.get(domain, [])}
+def get_domain_history(
+    domain: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    bucket: Optional[str] = None,
+):
+    """Return history for a specific domain between start and end (ISO
+    timestamps, UTC). Without bucket the raw event timestamps are returned;
+    with bucket "minute", "hour" or "day" the pre-aggregated counts are."""
+    for value in (start, end):
+        if value is not None:
+            try:
+                datetime.datetime.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid timestamp {value!r}")
+    if bucket is None:
+        return {"domain": domain, "events": stats_store.events(domain, start, end)}
+    if bucket not in STATS_BUCKETS:
+        raise HTTPException(status_code=400, detail="bucket must be minute, hour or day")
+    return {"domain": domain, "bucket": bucket, "buckets": stats_store.buckets(domain, bucket, start, end)}
+
+
+@app.get("/stats/top")
+def get_top_domains(
+    k: int = Query(10, ge=1, le=STATS_TOP_CAPACITY),
+    window: str = "all",
+    prefix: Optional[str] = None,
+):
+    """Return the k most generated domains in window ("hour", "day", "week"
+    or "all"), optionally only those starting with prefix. Counts are
+    estimates that may be high by at most "error"."""
+    if window != "all" and window not in STATS_TOP_WINDOWS:
+        raise HTTPException(status_code=400, detail="window must be hour, day, week or all")
+    return {"window": window, "k": k, "prefix": prefix, "domains": top_domains.top(k, window, prefix)}
 
 
 @app.get("/stats")
 def get_stats():
     """Return aggregated graph generation statistics."""
-    return _read_stats()
+    return stats_store.totals()
 
 @app.get("/login/{user}/{passw}")
 def login(user:str,passw:str):
-    for i in data:
-        if len(i) >= 4 and i[2] == user and i[3] == passw:
-            append_log("login", i[0])
-            return {"success": i[1], "id": i[0]}
+    account = users.find_by_login(user, passw)
+    if account is not None:
+        append_log("login", account["id"])
+        return {"success": account["name"], "id": account["id"]}
     return {"success": "no"}
 
 
@@ -1079,14 +3647,7 @@ def logout(user_id: str):
     return {"success": True}
 @app.get("/signup/{user}/{passw}/{name}")
 def signup(user:str,passw:str,name:str):
-    global next_user_id
-    uid = str(next_user_id)
-    next_user_id += 1
-    file_entry = f"{uid}:{name}:{user}:{passw}"
-    array_entry = [uid, name, user, passw]
-    data.append(array_entry)
-    with open(DATA_FILE_PATH, "a") as file:
-        file.write(f"\n{file_entry}")
+    uid = users.create(name, user, passw)
     append_log("signup", uid)
     return {"success": True, "id": uid}
 
@@ -1118,24 +3679,17 @@ def google_auth(payload: TokenPayload):
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid token")
 
-    for entry in data:
-        if len(entry) >= 3 and entry[2] == email:
-            append_log("login", entry[0])
-            return {
-                "success": entry[1],
-                "id": entry[0],
-                "email": email,
-                "picture": picture,
-            }
+    account = users.find_by_email(email)
+    if account is not None:
+        append_log("login", account["id"])
+        return {
+            "success": account["name"],
+            "id": account["id"],
+            "email": email,
+            "picture": picture,
+        }
 
-    global next_user_id
-    uid = str(next_user_id)
-    next_user_id += 1
-    file_entry = f"{uid}:{name}:{email}:"
-    array_entry = [uid, name, email, ""]
-    data.append(array_entry)
-    with open(DATA_FILE_PATH, "a") as file:
-        file.write(f"\n{file_entry}")
+    uid = users.create(name, email)
     append_log("login", uid)
     return {"success": name, "id": uid, "email": email, "picture": picture}
 
@@ -1143,22 +3697,20 @@ def google_auth(payload: TokenPayload):
 @app.get("/posts")
 def get_posts():
     """Return all blog posts."""
-    return _read_blog_posts()
+    return blog_posts.all()
 
 
 @app.get("/posts/{post_id}")
 def get_post(post_id: str):
     """Return a single blog post by its ID."""
-    posts = _read_blog_posts()
-    for post in posts:
-        if post["id"] == post_id:
-            return post
-    raise HTTPException(status_code=404, detail="Post not found")
+    post = blog_posts.get(post_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return post
 
 
 @app.post("/posts")
 def create_post(post: BlogPost):
-    posts = _read_blog_posts()
     new_post = {
         "id": uuid.uuid4().hex,
         "title": post.title,
@@ -1166,8 +3718,7 @@ def create_post(post: BlogPost):
         "coverImage": post.cover_image,
         "date": datetime.datetime.utcnow().isoformat(),
     }
-    posts.insert(0, new_post)
-    _write_blog_posts(posts)
+    blog_posts.add(new_post)
     return {"success": True, "id": new_post["id"]}
 
 
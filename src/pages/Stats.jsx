@@ -29,17 +29,13 @@ export default function Stats() {
 
   useEffect(() => {
     if (!selectedDomain) return;
-    fetch(`http://127.0.0.1:8000/stats/history/${encodeURIComponent(selectedDomain)}`)
+    fetch(`http://127.0.0.1:8000/stats/history/${encodeURIComponent(selectedDomain)}?bucket=day`)
       .then((res) => res.json())
       .then((data) => {
-        const counts = (data.events || []).reduce((acc, ts) => {
-          const date = ts.slice(0, 10);
-          acc[date] = (acc[date] || 0) + 1;
-          return acc;
-        }, {});
-        const historyData = Object.entries(counts)
-          .map(([date, count]) => ({ date: new Date(date).getTime(), count }))
-          .sort((a, b) => a.date - b.date);
+        const historyData = (data.buckets || []).map(({ start, count }) => ({
+          date: new Date(start.slice(0, 10)).getTime(),
+          count,
+        }));
         setDomainHistory(historyData);
       })
       .catch(() => setDomainHistory([]));
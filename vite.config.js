@@ -21,6 +21,7 @@ export default defineConfig({
         "**/stats_history.json",
         "***/blog_posts.json",
         "***/chain_cache.txt",
+        "**/state.db*",
       ],
     },
   },